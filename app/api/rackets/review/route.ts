@@ -80,5 +80,20 @@ export async function POST(request: Request) {
     return NextResponse.json({ error: error.message }, { status: 500 });
   }
 
+  // Refresh the recommender's review aggregates for this racket (best effort,
+  // a busy recommender can't hold up the review for more than 2 seconds)
+  if (process.env.RECOMMENDER_URL) {
+    try {
+      await fetch(`${process.env.RECOMMENDER_URL}/api/catalog/reviews`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ racket_ids: [parseInt(racketId)] }),
+        signal: AbortSignal.timeout(2000),
+      });
+    } catch (err) {
+      console.log("Recommender review refresh failed:", err);
+    }
+  }
+
   return NextResponse.json({ success: true });
 }
\ No newline at end of file
@@ -0,0 +1,52 @@
+import numpy as np
+
+
+#translation_map and question_weights compiled into dense arrays for one catalog's columns
+#each question gets a block of rows (answers x features) holding its weighted metric deltas,
+#already divided by the scaler so a user vector comes out in the scaled space
+class AnswerMatrix:
+    def __init__(self, translation_map, question_weights, baseline, cols, scale):
+        col_index = {k: i for i, k in enumerate(cols)}
+
+        self.questions = list(translation_map)
+        self.answers = [list(translation_map[q]) for q in self.questions]
+        self.answer_index = [{a: i for i, a in enumerate(opts)} for opts in self.answers]
+        self.radices = [len(opts) for opts in self.answers]
+
+        #where each question's block starts in deltas
+        self.offsets = np.cumsum([0] + self.radices[:-1])
+
+        rows = []
+        for question, opts in zip(self.questions, self.answers):
+            weight = question_weights.get(question, 1)
+            for answer in opts:
+                row = np.zeros(len(cols))
+                metrics = translation_map[question][answer].get("metrics", {})
+                for key_metric, value_metric in metrics.items():
+                    if key_metric in col_index:
+                        row[col_index[key_metric]] += weight * value_metric
+                rows.append(row)
+
+        #unanswered questions point at this all zero row
+        rows.append(np.zeros(len(cols)))
+        self.missing = len(rows) - 1
+
+        base = np.array([baseline.get(col, 0) for col in cols], dtype=float)
+        self.base = (base - scale.mean_) / scale.scale_
+        self.deltas = np.array(rows) / scale.scale_
+
+    #position of each answer inside its question, -1 when missing or not in translation_map
+    #keys outside the questionnaire are ignored, same as the old user_vector
+    def encode(self, list_of_answers):
+        codes = np.full((len(list_of_answers), len(self.questions)), -1, dtype=np.int64)
+        for row, user_ans in enumerate(list_of_answers):
+            for j, (question, index) in enumerate(zip(self.questions, self.answer_index)):
+                i = index.get(user_ans.get(question))
+                if i is not None:
+                    codes[row, j] = i
+        return codes
+
+    #scaled user vectors: baseline plus the selected delta rows, one gather and sum for the batch
+    def vectors(self, codes):
+        rows = np.where(codes >= 0, codes + self.offsets, self.missing)
+        return self.base + self.deltas[rows].sum(axis=1)
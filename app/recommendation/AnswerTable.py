@@ -0,0 +1,109 @@
+import os
+import json
+import numpy as np
+from Snapshot import Artifact, replace_file
+
+#how many answer sets go through knn at once while building the table
+CHUNK_SIZE = 20000
+
+
+#precomputed neighbours for every complete answer set of a questionnaire
+#row i holds the neighbours of the answer set whose mixed radix code is i
+class AnswerTable:
+    def __init__(self, version, questions, answers, neighbors):
+        self.version = version
+        self.questions = questions
+        self.answers = answers
+        self.neighbors = neighbors
+        self.radices = [len(a) for a in answers]
+
+    #table rows for answers encoded by AnswerMatrix.encode, -1 when an answer is missing
+    def codes(self, answer_codes):
+        complete = (answer_codes >= 0).all(axis=1)
+        codes = np.ravel_multi_index(tuple(np.maximum(answer_codes, 0).T), self.radices)
+        return np.where(complete, codes, -1)
+
+
+#runs every answer set of the questionnaire through neighbors() in batches
+#neighbors takes an (n x questions) array of answer codes and returns (n x k) rows
+def build_answer_table(version, answer_matrix, neighbors, n_rows):
+    radices = answer_matrix.radices
+    total = int(np.prod(radices))
+
+    dtype = np.uint16 if n_rows <= np.iinfo(np.uint16).max else np.uint32
+    table = None
+
+    for start in range(0, total, CHUNK_SIZE):
+        code = np.arange(start, min(start + CHUNK_SIZE, total))
+        answer_codes = np.stack(np.unravel_index(code, radices), axis=1)
+        indices = neighbors(answer_codes)
+        if table is None:
+            table = np.empty((total, indices.shape[1]), dtype=dtype)
+        table[code] = indices
+
+    return AnswerTable(version, answer_matrix.questions, answer_matrix.answers, table)
+
+
+#brings a table up to date after the catalog rows at `rows` changed or were appended, without rebuilding it
+#moved maps the old catalog positions onto the new ones when rows were dropped, -1 for a dropped row
+#an answer set only needs a new knn query when one of its neighbours changed or was dropped, or a changed row
+#is now at least as close as its k-th neighbour, every other ranking stays the same (up to equally distant ties)
+def patch_answer_table(table, version, answer_matrix, scaled_x, rows, knn, moved=None):
+    k = table.neighbors.shape[1]
+    dtype = np.uint16 if len(scaled_x) <= np.iinfo(np.uint16).max else np.uint32
+    patched = table.neighbors.astype(dtype)
+    changed = scaled_x[rows]
+    changed_sq = np.einsum('ij,ij->i', changed, changed)
+    total = len(patched)
+
+    for start in range(0, total, CHUNK_SIZE):
+        code = np.arange(start, min(start + CHUNK_SIZE, total))
+        answer_codes = np.stack(np.unravel_index(code, table.radices), axis=1)
+        vectors = answer_matrix.vectors(answer_codes)
+        current = patched[code].astype(np.int64)
+
+        stale = np.zeros(len(code), dtype=bool)
+        if moved is not None:
+            current = moved[current]
+            stale = (current < 0).any(axis=1)
+            current = np.maximum(current, 0)
+            patched[code] = current
+
+        kth = ((scaled_x[current[:, -1]] - vectors) ** 2).sum(axis=1)
+        stale |= np.isin(current, rows).any(axis=1)
+        if len(rows):
+            to_changed = changed_sq - 2 * (vectors @ changed.T) + np.einsum('ij,ij->i', vectors, vectors)[:, None]
+            #a little slack so float noise can only cause an extra query, never a missed one
+            stale |= to_changed.min(axis=1) <= kth + 1e-9
+
+        if stale.any():
+            distances, indices = knn.kneighbors(vectors[stale], k)
+            patched[code[stale]] = indices
+
+    return AnswerTable(version, table.questions, table.answers, patched)
+
+
+#the table lives next to its catalog version's arrays and is memory mapped like them
+def save_answer_table(name, table):
+    artifact = Artifact(name, table.version)
+    artifact.save('answers', table.neighbors)
+
+    questionnaire_path = os.path.join(artifact.path, 'answers.json')
+    replace_file(questionnaire_path, lambda f: json.dump({'questions': table.questions, 'answers': table.answers}, f), 'w')
+
+
+#loads the table for this catalog version, None when it hasn't been built for it
+def load_answer_table(name, version, answer_matrix):
+    artifact = Artifact(name, version)
+    questionnaire_path = os.path.join(artifact.path, 'answers.json')
+    if not (artifact.exists('answers') and os.path.exists(questionnaire_path)):
+        return None
+
+    with open(questionnaire_path) as f:
+        questionnaire = json.load(f)
+
+    #a table built for an older questionnaire would decode answers wrongly
+    if questionnaire['questions'] != answer_matrix.questions or questionnaire['answers'] != answer_matrix.answers:
+        return None
+
+    return AnswerTable(version, questionnaire['questions'], questionnaire['answers'], artifact.load('answers'))
@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+import platform
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+from AnswerMatrix import AnswerMatrix
+from KnnIndex import INDEX_BACKENDS, KNN_BACKEND, IVFIndex, KDTreeIndex, build_index, recall_at_k
+import MachineLearning
+import StringRecommendation
+
+#spec strings in the shapes the scrapers actually produce, missing values included
+WEIGHTS = ['4U / G5', '3U / G5', '5U (75-79g)', '2U', '4U', '6U', '83g', '88 grams', 'Approx. 85g', 'light', None]
+BALANCES = ['Head Heavy', 'Head-light', 'Even Balance', 'Balanced', 'Power', '295mm', '310 mm', '300mm', 'Head Heavy (305mm)', 'unknown', None]
+STIFFNESSES = ['Stiff', 'Extra Stiff', 'Slightly Stiff', 'Flexible', 'Hi-Flex', 'Medium', 'Soft', 'S○○●○○F', 's●○○○○f', 'Hard', None]
+TENSIONS = ['28 lbs', '30lbs(13.5kg)', '≦ 28 lbs', '24-28 lbs', '32', None]
+FEELS = ['High repulsion, excellent control', 'Medium repulsion, hard feeling', 'Soft feeling', 'Great durability',
+         'High resilience, soft feeling, high durability', 'Hard feeling', None]
+GAUGES = ['0.66mm', '0.68mm', '0.70mm', '0.65', None]
+
+#catalog sizes the engine benchmark runs by default
+ENGINE_ROWS = [1000, 10000, 100000, 1000000]
+
+
+#rackets shaped like fetch_rackets() output, specs get a random suffix so values aren't all repeats
+#the offer columns are left empty, they aren't features
+def synthetic_rackets(n, seed=0):
+    rng = np.random.default_rng(seed)
+
+    def specs(values):
+        picked = rng.choice(np.array(values, dtype=object), n)
+        suffix = rng.integers(0, 50, n)
+        return [v if v is None or s else f"{v} #{s}" for v, s in zip(picked, suffix)]
+
+    return pd.DataFrame({
+        'racket_id': np.arange(1, n + 1),
+        'name': [f"Synthetic Racket {i}" for i in range(n)],
+        'color': rng.choice(np.array(['Black', 'Red', 'Blue', None], dtype=object), n),
+        'availability': 'In stock',
+        'description': '',
+        'img_url': '',
+        'manufacturer_id': rng.choice([6, 9, 16, 17, 3, None], n),
+        'weight': specs(WEIGHTS),
+        'balance': specs(BALANCES),
+        'stiffness': specs(STIFFNESSES),
+        'max_tension': rng.choice(np.array(TENSIONS, dtype=object), n),
+        'price': np.where(rng.random(n) < 0.1, np.nan, rng.uniform(20, 300, n).round(2)),
+        'median_price': np.nan,
+        'in_stock_price': np.nan,
+        'in_stock': rng.random(n) < 0.8,
+        'offers': [[] for _ in range(n)],
+    })
+
+
+#strings shaped like fetch_strings() output
+def synthetic_strings(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'string_id': np.arange(1, n + 1),
+        'name': [f"Synthetic String {i}" for i in range(n)],
+        'manufacturer_id': rng.choice([6, 9, 16], n),
+        'img_url': rng.choice(np.array(['', None], dtype=object), n),
+        'feel': rng.choice(np.array(FEELS, dtype=object), n),
+        'gauge': rng.choice(np.array(GAUGES, dtype=object), n),
+    })
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+#time to standardize and rebuild each catalog, which decides how often we can refresh
+def bench_rebuild(rows):
+    rackets = synthetic_rackets(rows)
+    strings = synthetic_strings(rows)
+
+    _, racket_std = timed(MachineLearning.standardizer, rackets.copy())
+    _, racket_build = timed(MachineLearning.build_catalog, rackets.copy())
+    _, string_std = timed(StringRecommendation.standardizer, strings.copy())
+    _, string_build = timed(StringRecommendation.build_catalog, strings.copy())
+
+    print(f"{rows} rows")
+    print(f"  racket standardizer  {racket_std * 1000:9.1f} ms")
+    print(f"  racket build_catalog {racket_build * 1000:9.1f} ms")
+    print(f"  string standardizer  {string_std * 1000:9.1f} ms")
+    print(f"  string build_catalog {string_build * 1000:9.1f} ms")
+
+
+#random complete questionnaires turned into scaled user vectors, the shape real queries have
+def synthetic_queries(answer_matrix, n, seed=0):
+    rng = np.random.default_rng(seed)
+    answer_codes = np.stack([rng.integers(0, radix, n) for radix in answer_matrix.radices], axis=1)
+    return answer_matrix.vectors(answer_codes)
+
+
+#scaled synthetic racket catalog plus scaled user vectors to query it with
+def synthetic_index_data(rows, n_queries):
+    catalog, cols, scale, x, scaled_x = MachineLearning.build_catalog(synthetic_rackets(rows))
+    answer_matrix = AnswerMatrix(MachineLearning.translation_map, MachineLearning.question_weights, MachineLearning.baseline, cols, scale)
+    return scaled_x, synthetic_queries(answer_matrix, n_queries)
+
+
+#median single query latency in seconds
+def single_latency(index, queries, k):
+    single = []
+    for q in queries:
+        _, elapsed = timed(index.kneighbors, q[None, :], k)
+        single.append(elapsed)
+    return np.median(single)
+
+
+#build time, build memory and query latency of every knn backend on the same catalog
+def bench_index(rows, k=3, singles=200, batch=1000):
+    scaled_x, queries = synthetic_index_data(rows, max(singles, batch))
+
+    print(f"{rows} rows, {scaled_x.shape[1]} features, k={k}")
+    print(f"  {'backend':10} {'build ms':>10} {'build MB':>10} {'single us':>10} {'batch us/q':>11}")
+    for name, backend in INDEX_BACKENDS.items():
+        tracemalloc.start()
+        index, build = timed(backend, scaled_x)
+        memory = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+
+        single = single_latency(index, queries[:singles], k)
+        _, batched = timed(index.kneighbors, queries[:batch], k)
+
+        print(f"  {name:10} {build * 1000:10.2f} {memory:10.2f} {single * 1e6:10.1f} {batched / batch * 1e6:11.2f}")
+
+
+#recall@k and latency of the approximate ivf index per n_probe, next to the exact kd_tree
+def bench_ann(rows, k=3, probes=(1, 2, 4, 8, 16, 32), n_queries=300):
+    scaled_x, queries = synthetic_index_data(rows, n_queries)
+
+    exact = KDTreeIndex(scaled_x)
+    print(f"{rows} rows, k={k}, kd_tree single query {single_latency(exact, queries, k) * 1e6:.1f} us")
+    print(f"  {'n_probe':>8} {'recall@k':>9} {'single us':>10}")
+    for n_probe in probes:
+        index = IVFIndex(scaled_x, n_probe=n_probe)
+        recall = recall_at_k(index, scaled_x, queries, k)
+        print(f"  {n_probe:8} {recall:9.3f} {single_latency(index, queries, k) * 1e6:10.1f}")
+
+
+#p50 / p95 / p99 of a list of latencies, in milliseconds
+def percentiles(seconds):
+    p50, p95, p99 = np.percentile(np.asarray(seconds) * 1000, [50, 95, 99])
+    return {'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99)}
+
+
+#questionnaires like the frontend sends, each question answered nine times out of ten
+def synthetic_answers(translation_map, n, seed=0):
+    rng = np.random.default_rng(seed)
+    answers = []
+    for _ in range(n):
+        user_ans = {}
+        for question, options in translation_map.items():
+            if rng.random() < 0.9:
+                options = list(options)
+                user_ans[question] = options[rng.integers(len(options))]
+        answers.append(user_ans)
+    return answers
+
+
+#end to end timings of one recommender on a synthetic catalog of `rows` rows:
+#standardization, scaler fit, index build, model assembly and get_rec latency one query
+#at a time and in batches. no answer table is built, every query goes through the knn index
+def bench_engine_catalog(engine, catalog, queries=500, batch=100, batches=20):
+    _, standardize = timed(engine.standardize, catalog.copy())
+    (standardized, cols, scale, x, scaled_x), build_catalog = timed(engine.build_catalog, catalog.copy())
+    _, scaler_fit = timed(StandardScaler().fit_transform, x)
+    _, index_build = timed(build_index, scaled_x)
+    model, assemble = timed(engine.assemble_model, 'benchmark', time.time(), standardized, cols, scale, scaled_x, None)
+
+    #serve the synthetic model through the same entry points the routes call,
+    #with the response cache off so repeated answer sets are timed like any other
+    engine.slot.current = model
+    engine.cache.size = 0
+    answers = synthetic_answers(engine.translation_map, max(queries, batch * batches))
+
+    single = [timed(engine.recommend, user_ans)[1] for user_ans in answers[:queries]]
+    batched = [timed(engine.recommend_batch, answers[i * batch:(i + 1) * batch])[1] for i in range(batches)]
+
+    return {
+        'rows': len(catalog),
+        'features': len(cols),
+        'standardize_ms': standardize * 1000,
+        'scaler_fit_ms': scaler_fit * 1000,
+        'build_catalog_ms': build_catalog * 1000,
+        'index_build_ms': index_build * 1000,
+        'assemble_model_ms': assemble * 1000,
+        'single': percentiles(single),
+        'batch': dict(percentiles(batched), size=batch, per_query_ms=float(np.mean(batched)) * 1000 / batch),
+    }
+
+
+def print_engine(name, result):
+    print(f"  {name} ({result['features']} features)")
+    for key in ['standardize_ms', 'scaler_fit_ms', 'build_catalog_ms', 'index_build_ms', 'assemble_model_ms']:
+        print(f"    {key[:-3]:16} {result[key]:10.1f} ms")
+    for key in ['single', 'batch']:
+        p = result[key]
+        print(f"    {key:16} p50 {p['p50_ms']:8.3f} ms  p95 {p['p95_ms']:8.3f} ms  p99 {p['p99_ms']:8.3f} ms")
+    print(f"    batch of {result['batch']['size']} {result['batch']['per_query_ms']:.4f} ms per query")
+
+
+#the racket and string engines on synthetic catalogs, no supabase involved
+#returns everything as a dict so runs can be saved and compared against each other
+def bench_engine(row_counts, queries=500, batch=100, batches=20):
+    results = {
+        'machine': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'knn_backend': KNN_BACKEND,
+        },
+        'runs': [],
+    }
+
+    for rows in row_counts:
+        print(f"{rows} rows")
+        run = {'rows': rows}
+        run['racket'] = bench_engine_catalog(MachineLearning.engine, synthetic_rackets(rows), queries, batch, batches)
+        print_engine('racket', run['racket'])
+        run['string'] = bench_engine_catalog(StringRecommendation.engine, synthetic_strings(rows), queries, batch, batches)
+        print_engine('string', run['string'])
+        results['runs'].append(run)
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the recommendation engine')
+    parser.add_argument('--rows', type=int, nargs='+')
+    parser.add_argument('--index', action='store_true', help='benchmark the knn backends instead of the catalog rebuild')
+    parser.add_argument('--ann', action='store_true', help='recall/latency sweep of the approximate ivf index')
+    parser.add_argument('--engine', action='store_true', help='end to end build and get_rec latency of both recommenders')
+    parser.add_argument('--out', help='with --engine, write the results as json to this file')
+    parser.add_argument('--queries', type=int, default=500, help='single queries per catalog with --engine')
+    parser.add_argument('--batch', type=int, default=100, help='answers per batched query with --engine')
+    args = parser.parse_args()
+
+    if args.engine:
+        results = bench_engine(args.rows or ENGINE_ROWS, args.queries, args.batch)
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"results written to {args.out}")
+        raise SystemExit
+
+    for rows in args.rows or [1000, 10000, 100000]:
+        if args.ann:
+            bench_ann(rows)
+        elif args.index:
+            bench_index(rows)
+        else:
+            bench_rebuild(rows)
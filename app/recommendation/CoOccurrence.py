@@ -0,0 +1,80 @@
+import os
+import numpy as np
+from scipy import sparse
+from Snapshot import SNAPSHOT_DIR, replace_file
+
+
+def cooccurrence_path(name):
+    return os.path.join(SNAPSHOT_DIR, f'{name}-cooccurrence.npz')
+
+
+#item-item co-occurrence of a favorites table: how often two items are favorited by the same user
+#stored as cosine similarity, count(i and j) / sqrt(count(i) * count(j)), in a sparse row per item
+#catalog_ids maps the rows of the catalog being served onto the matrix, -1 for items nobody favorited
+class CoOccurrence:
+    def __init__(self, ids, matrix, catalog_ids):
+        self.ids = ids
+        self.matrix = matrix
+        #row * size + column of every stored entry, sorted because csr rows and their columns are
+        self.keys = np.repeat(np.arange(len(ids), dtype=np.int64), np.diff(matrix.indptr)) * len(ids) + matrix.indices
+        self.catalog_positions = self.positions(catalog_ids)
+
+    #matrix rows of item ids, -1 where an item has no favorites
+    def positions(self, item_ids):
+        item_ids = np.asarray(item_ids)
+        if len(self.ids) == 0:
+            return np.full(item_ids.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.ids, item_ids), len(self.ids) - 1)
+        return np.where(self.ids[pos] == item_ids, pos, -1)
+
+    #collaborative score of each query's candidates: the summed co-occurrence rows of the query's seeds
+    #seeds is one array of matrix rows per query, candidates the catalog rows being ranked
+    #every (seed, candidate) pair is one binary search in the sorted entry keys, nothing is recomputed
+    def scores(self, seeds, candidates):
+        width = max(1, max(len(s) for s in seeds))
+        padded = np.full((len(seeds), width), -1, dtype=np.int64)
+        for row, s in enumerate(seeds):
+            padded[row, :len(s)] = s
+
+        positions = self.catalog_positions[candidates]
+        if len(self.keys) == 0:
+            return np.zeros(positions.shape)
+        keys = padded[:, :, None] * len(self.ids) + positions[:, None, :]
+        found = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        hit = (padded[:, :, None] >= 0) & (positions[:, None, :] >= 0) & (self.keys[found] == keys)
+        return np.where(hit, self.matrix.data[found], 0).sum(axis=1)
+
+
+#one pass over the (user_id, key) favorites: a sparse users x items matrix times its transpose
+def build_cooccurrence(favorites_df, key):
+    favorites_df = favorites_df.dropna(subset=['user_id', key]).drop_duplicates(subset=['user_id', key])
+    users, user_index = np.unique(favorites_df['user_id'].astype(str), return_inverse=True)
+    ids, item_index = np.unique(favorites_df[key].astype(np.int64), return_inverse=True)
+
+    liked = sparse.csr_matrix((np.ones(len(favorites_df)), (user_index, item_index)), shape=(len(users), len(ids)))
+    counts = (liked.T @ liked).tocsr()
+    counts.setdiag(0)
+    counts.eliminate_zeros()
+
+    #cosine, so an item everybody favorites doesn't pull every recommendation its way
+    popularity = np.asarray(liked.sum(axis=0)).ravel()
+    norm = sparse.diags(1 / np.sqrt(np.maximum(popularity, 1)))
+    return ids, (norm @ counts @ norm).astype(np.float32).tocsr()
+
+
+def save_cooccurrence(name, ids, matrix):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = cooccurrence_path(name)
+    replace_file(path, lambda f: np.savez(f, ids=ids, indptr=matrix.indptr, indices=matrix.indices.astype(np.int32), data=matrix.data))
+
+
+#the co-occurrence matrix lined up with a catalog, None until the offline job has run
+def load_cooccurrence(name, catalog_ids):
+    path = cooccurrence_path(name)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as arrays:
+        ids = arrays['ids']
+        matrix = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=(len(ids), len(ids)))
+    matrix.sort_indices()
+    return CoOccurrence(ids, matrix, catalog_ids)
@@ -0,0 +1,5 @@
+from supabase import create_client
+import supabase_env
+
+#one supabase client shared by every catalog
+supabase = create_client(supabase_env.NEXT_PUBLIC_SUPABASE_URL, supabase_env.NEXT_PUBLIC_SUPABASE_ANON_KEY )
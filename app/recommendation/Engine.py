@@ -0,0 +1,420 @@
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+from Database import supabase
+from Snapshot import Artifact, catalog_version, load_snapshot, save_snapshot
+from FeatureWeights import apply_weights, reweight_snapshot, weight_vector
+from ModelVersion import ModelVersion, ModelSlot, response_records, patch_records
+from AnswerMatrix import AnswerMatrix
+from AnswerTable import build_answer_table, load_answer_table, save_answer_table, patch_answer_table
+from KnnIndex import build_index
+from Partitions import PartitionedIndex
+from Metrics import METRICS
+from Rerank import pool_size, candidate_distances, mmr, relative_scores, boost_distances
+from CoOccurrence import cooccurrence_path, build_cooccurrence, save_cooccurrence, load_cooccurrence
+from Explain import feature_groups, contributions, contribution_members
+from Reviews import reviews_path, aggregate_reviews, merge_reviews, save_reviews, load_reviews, catalog_quality
+from Incremental import merge_rows, scaler_drift
+from ResponseCache import ResponseCache, cache_key
+
+#how many neighbours each recommendation returns unless the request asks for k, and the most it may ask for
+N_NEIGHBORS = 3
+MAX_NEIGHBORS = 100
+
+#rows changed in supabase are folded into the live model until the scaler statistics
+#drift this many standard deviations from the ones it was fitted on, past that the catalog is refit
+DRIFT_THRESHOLD = float(os.environ.get('RECOMMENDATION_DRIFT_THRESHOLD', 0.05))
+
+
+#one catalog's recommender: the supabase loader, standardization, snapshot, indexes, hot reload and
+#request path are the same for every catalog, the catalog module only passes in what differs
+#name is the supabase table and snapshot name, key its id column
+#standardize cleans the raw rows, categories are one-hot encoded and excludes never become features
+#enrich(df, ids) adds columns from other tables to fetched rows (offers for rackets)
+#favorites and reviews name the tables behind the co-occurrence blend and the review quality boost
+class Recommender:
+    def __init__(self, name, key, standardize, categories, excludes, baseline, translation_map, question_weights,
+                 feature_weights, response_columns, range_columns, partitions, explain_features,
+                 enrich=None, favorites=None, reviews=None):
+        self.name = name
+        self.key = key
+        self.standardize = standardize
+        self.categories = categories
+        self.excludes = excludes
+        self.baseline = baseline
+        self.translation_map = translation_map
+        self.question_weights = question_weights
+        self.feature_weights = feature_weights
+        self.response_columns = response_columns
+        self.range_columns = range_columns
+        self.partitions = partitions
+        self.explain_features = explain_features
+        self.enrich = enrich
+        self.favorites = favorites
+        self.reviews = reviews
+        self.slot = ModelSlot(name, self.build_model, self.side_stamp, self.with_side_data)
+        self.cache = ResponseCache(name)
+
+    #get data from supabase, ids limits the fetch to those rows for folding changes into the live model
+    def fetch(self, ids=None):
+        query = supabase.table(self.name).select('*')
+        if ids is not None:
+            query = query.in_(self.key, list(ids))
+        df = pd.DataFrame(query.execute().data)
+        if len(df) == 0:
+            return df
+
+        if self.enrich is not None:
+            df = self.enrich(df, ids)
+        df = df.drop_duplicates(subset=self.key)
+        df = df.drop_duplicates(subset='name', keep='first')
+        return df
+
+    #standardizes the raw rows and fits the scaler
+    def build_catalog(self, df):
+        df = self.standardize(df)
+
+        col_onehot = pd.get_dummies(df, columns=self.categories)
+
+        cols = [ i for i in col_onehot if i not in self.excludes]
+
+        scale = StandardScaler()
+
+        x = col_onehot[cols].values.astype(float)
+
+        scaled_x = scale.fit_transform(x)
+
+        scale, scaled_x = apply_weights(scale, scaled_x, weight_vector(cols, self.feature_weights))
+
+        return df, cols, scale, x, scaled_x
+
+    #refreshes the snapshot from supabase, run explicitly instead of at boot
+    def refresh_snapshot(self):
+        catalog, cols, scale, x, scaled_x = self.build_catalog(self.fetch())
+        return save_snapshot(self.name, catalog, cols, scale, x, scaled_x, weight_vector(cols, self.feature_weights))
+
+    #offline job: rebuilds the item-item co-occurrence matrix from every user's favorites
+    #the workers pick it up with the next model they build
+    def refresh_cooccurrence(self):
+        favorites = supabase.table(self.favorites).select(f'user_id, {self.key}').execute()
+        ids, matrix = build_cooccurrence(pd.DataFrame(favorites.data, columns=['user_id', self.key]), self.key)
+        save_cooccurrence(self.name, ids, matrix)
+        return matrix
+
+    #(key, rating) of every review, or only of the rows in ids
+    def fetch_reviews(self, ids=None):
+        query = supabase.table(self.reviews).select(f'{self.key}, rating')
+        if ids is not None:
+            query = query.in_(self.key, list(ids))
+        return pd.DataFrame(query.execute().data, columns=[self.key, 'rating'])
+
+    #offline job: rebuilds the per row review aggregates in one pass over the review table
+    def refresh_reviews(self):
+        aggregates = aggregate_reviews(self.fetch_reviews(), self.key)
+        save_reviews(self.name, aggregates)
+        return aggregates
+
+    #modification times of the data RefreshCatalog.py rewrites without a new catalog version,
+    #None for a file that isn't there, so the reloader can tell when it changed
+    def side_stamp(self):
+        paths = ([cooccurrence_path(self.name)] if self.favorites else []) + ([reviews_path(self.name)] if self.reviews else [])
+        return tuple(os.stat(path).st_mtime_ns if os.path.exists(path) else None for path in paths)
+
+    #the model with the co-occurrence matrix and review aggregates currently on disk
+    def with_side_data(self, model):
+        return model._replace(
+            cooccurrence=load_cooccurrence(self.name, model.catalog[self.key].to_numpy()) if self.favorites else None,
+            review_quality=self.quality(model.catalog, load_reviews(self.name)) if self.reviews else None,
+        )
+
+    def quality(self, catalog, aggregates):
+        return None if aggregates is None else catalog_quality(aggregates, catalog[self.key].to_numpy())
+
+    #indexes, compiled questionnaire and response records over a standardized and scaled catalog
+    #scaled_x and the partition matrices are the memory mapped arrays of the version's artifact
+    #previous is the model an incremental update started from, rows the changed or appended rows
+    #and moved the old rows' new positions: its untouched partitions and records are carried over
+    def assemble_model(self, version, built_at, catalog, cols, scale, scaled_x, artifact, previous=None, rows=None, moved=None):
+        #knn model, the backend is picked by RECOMMENDATION_KNN_BACKEND
+        knn = build_index(scaled_x)
+
+        if previous is None:
+            partitions = PartitionedIndex(catalog, scaled_x, self.partitions, self.range_columns, knn, artifact)
+            records = response_records(catalog, self.response_columns, artifact)
+        else:
+            partitions = PartitionedIndex(catalog, scaled_x, self.partitions, self.range_columns, knn, artifact, previous.partitions, rows, moved)
+            records = patch_records(previous.records, catalog, self.response_columns, rows, moved, artifact)
+
+        return ModelVersion(
+            version=version,
+            built_at=built_at,
+            catalog=catalog,
+            cols=cols,
+            scale=scale,
+            scaled_x=scaled_x,
+            knn=knn,
+            partitions=partitions,
+            answer_matrix=AnswerMatrix(self.translation_map, self.question_weights, self.baseline, cols, scale),
+            answers=None,
+            records=records,
+            cooccurrence=load_cooccurrence(self.name, catalog[self.key].to_numpy()) if self.favorites else None,
+            review_quality=self.quality(catalog, load_reviews(self.name)) if self.reviews else None,
+        )
+
+    #looks up the neighbours of answer sets straight from the index, what the answer table stores
+    def table_neighbors(self, model, k):
+        def neighbors(answer_codes):
+            distances, indices = model.knn.kneighbors(model.answer_matrix.vectors(answer_codes), k)
+            return indices
+        return neighbors
+
+    #loads the catalog snapshot, only falls back to supabase when there is none yet
+    #refresh=True pulls the catalog from supabase first and rebuilds the answer table, which is what RefreshCatalog.py does
+    def build_model(self, refresh=False):
+        snap = None if refresh else load_snapshot(self.name)
+        if snap is None:
+            self.refresh_snapshot()
+            snap = load_snapshot(self.name)
+        snap = reweight_snapshot(self.name, snap, weight_vector(snap['cols'], self.feature_weights))
+
+        model = self.assemble_model(snap['version'], snap['built_at'], snap['catalog'], snap['cols'], snap['scale'], snap['scaled_x'], snap['artifact'])
+
+        #the answer table is tied to the catalog version, a new version gets a new table
+        answers = load_answer_table(self.name, model.version, model.answer_matrix)
+        if answers is None and refresh:
+            answers = build_answer_table(model.version, model.answer_matrix, self.table_neighbors(model, N_NEIGHBORS), len(model.catalog))
+            save_answer_table(self.name, answers)
+        elif answers is None:
+            print(f"No answer table for {self.name} model {model.version}, serving live knn until the next refresh")
+
+        return model._replace(answers=answers)
+
+    #standardizes changed rows into the live model's feature columns
+    #the features come back None when a row has a category the model has never seen
+    def changed_features(self, df, cols):
+        df = self.standardize(df)
+        col_onehot = pd.get_dummies(df, columns=self.categories)
+        if any(i not in self.excludes and i not in cols for i in col_onehot):
+            return df, None
+        return df, col_onehot.reindex(columns=cols, fill_value=0).values.astype(float)
+
+    #folds rows the scrapers added, changed or removed into the live model instead of rebuilding it:
+    #only those rows are fetched, standardized and scaled with the fitted scaler,
+    #then replaced, appended or dropped in the feature matrix, and the answer table is patched
+    #ids that are neither in supabase nor in the catalog change nothing
+    #a new category or scaler drift past DRIFT_THRESHOLD falls back to a full refresh
+    def update(self, ids):
+        def change(model):
+            changed = self.fetch(ids)
+            fetched = changed[self.key] if len(changed) else pd.Series([], dtype=object)
+            in_catalog = model.catalog[self.key]
+            removed = in_catalog[in_catalog.isin(ids) & ~in_catalog.isin(fetched)].tolist()
+
+            if len(changed):
+                #a full fetch keeps the first row of each name, keep it that way
+                taken = model.catalog.loc[~in_catalog.isin(fetched) & ~in_catalog.isin(removed), 'name']
+                changed = changed[~changed['name'].isin(taken)].drop_duplicates(subset='name', keep='first')
+            if len(changed) == 0 and not removed:
+                return model
+
+            if len(changed):
+                changed, changed_x = self.changed_features(changed, model.cols)
+                if changed_x is None:
+                    print(f"New {self.name} categories, refitting the {self.name} model")
+                    return None
+                changed_scaled_x = model.scale.transform(changed_x)
+            else:
+                changed, changed_x, changed_scaled_x = model.catalog.iloc[:0], np.empty((0, len(model.cols))), np.empty((0, len(model.cols)))
+
+            #the raw features of the live version, merged next to the scaled ones rather than unscaled back from them
+            live = Artifact(self.name, model.version)
+            if not live.exists('x'):
+                return None
+            catalog, x, scaled_x, rows, moved = merge_rows(model.catalog, live.load('x'), model.scaled_x, changed, changed_x, changed_scaled_x, self.key, removed)
+            drift = scaler_drift(model.scale, scaled_x)
+            if drift > DRIFT_THRESHOLD:
+                print(f"Scaler drifted {drift:.3f}, refitting the {self.name} model")
+                return None
+
+            #rows posted again without a change hash to the live version, nothing to rebuild
+            weights = weight_vector(model.cols, self.feature_weights)
+            if catalog_version(catalog, x, weights, model.scale) == model.version:
+                return model
+
+            version = save_snapshot(self.name, catalog, model.cols, model.scale, x, scaled_x, weights)
+            artifact = Artifact(self.name, version)
+            scaled_x = artifact.load('scaled_x')
+            updated = self.assemble_model(version, time.time(), catalog, model.cols, model.scale, scaled_x, artifact, model, rows, moved)
+
+            answers = None
+            if model.answers is not None:
+                answers = patch_answer_table(model.answers, version, updated.answer_matrix, scaled_x, rows, updated.knn, moved if removed else None)
+                save_answer_table(self.name, answers)
+            return updated._replace(answers=answers)
+
+        return self.slot.update(change)
+
+    #folds new or edited reviews into the stored aggregates: only the reviews of those rows are fetched
+    #and their sums and counts replaced, then the live model gets the new review scores
+    #the other workers load the saved aggregates when their reloader sees the file change
+    def update_reviews(self, ids):
+        def change(model):
+            aggregates = load_reviews(self.name)
+            if aggregates is None:
+                aggregates = aggregate_reviews(self.fetch_reviews(), self.key)
+            else:
+                aggregates = merge_reviews(aggregates, ids, self.fetch_reviews(ids), self.key)
+            save_reviews(self.name, aggregates)
+            return model._replace(review_quality=self.quality(model.catalog, aggregates))
+
+        return self.slot.update(change)
+
+    def load_model(self):
+        return self.slot.get()
+
+    def reload_model(self):
+        return self.slot.reload()
+
+    #creates one scaled user vector per set of answers
+    def user_matrix(self, list_of_answers, model):
+        return model.answer_matrix.vectors(model.answer_matrix.encode(list_of_answers))
+
+    #neighbour rows for many sets of answers, table hits are looked up and the misses share one knn query
+    #filters like {'manufacturer_id': 6} search only the matching partition,
+    #ranges like {'price': (None, 50)} only the rows inside every range
+    #k and offset pick the page of the ranking, offset=10, k=10 is the second page of ten
+    def batch_neighbors(self, list_of_answers, model, filters=None, ranges=None, k=N_NEIGHBORS, offset=0):
+        start = time.perf_counter()
+        answer_codes = model.answer_matrix.encode(list_of_answers)
+        start = METRICS.lap(self.name, 'encode', start)
+
+        if filters or ranges:
+            queries = model.answer_matrix.vectors(answer_codes)
+            start = METRICS.lap(self.name, 'user_vector', start)
+            distances, indices = model.partitions.kneighbors(queries, k, filters, ranges, offset)
+            METRICS.lap(self.name, 'knn', start)
+            return indices
+
+        #the table only holds the first N_NEIGHBORS of each ranking
+        if model.answers is None or offset + k > model.answers.neighbors.shape[1]:
+            queries = model.answer_matrix.vectors(answer_codes)
+            start = METRICS.lap(self.name, 'user_vector', start)
+            distances, indices = model.knn.kneighbors(queries, k, offset)
+            METRICS.lap(self.name, 'knn', start)
+            return indices
+
+        codes = model.answers.codes(answer_codes)
+        indices = model.answers.neighbors[np.maximum(codes, 0), offset:offset + k].astype(np.int64)
+        start = METRICS.lap(self.name, 'table', start)
+
+        misses = np.flatnonzero(codes < 0)
+        if len(misses):
+            queries = model.answer_matrix.vectors(answer_codes[misses])
+            start = METRICS.lap(self.name, 'user_vector', start)
+            distances, neighbors = model.knn.kneighbors(queries, k, offset)
+            indices[misses] = neighbors
+            METRICS.lap(self.name, 'knn', start)
+
+        return indices
+
+    #co-occurrence seeds of each query: the matrix rows of the items the user liked,
+    #else the nearest candidate, so the page leans towards what people who favorite it also favorite
+    def cooccurrence_seeds(self, model, candidates, liked):
+        if liked:
+            return [model.cooccurrence.positions(list(liked))] * len(candidates)
+        return [model.cooccurrence.catalog_positions[row] for row in candidates[:, :1]]
+
+    #neighbour rows re-ranked from a larger pool of nearest candidates:
+    #blend (0..1) pulls items favorited alongside the seeds forward, quality (0..1) well reviewed ones,
+    #then diversity (0..1) lets mmr spread the page out
+    #the pool holds at most MAX_NEIGHBORS candidates, so a re-ranked page has to end by then
+    def reranked_neighbors(self, list_of_answers, model, filters, ranges, k, offset, diversity, blend, liked, quality):
+        if offset + k > MAX_NEIGHBORS:
+            raise ValueError(f"re-ranked pages end at rank {MAX_NEIGHBORS}, offset + k can't be more than that")
+        candidates = self.batch_neighbors(list_of_answers, model, filters, ranges, pool_size(k, offset, MAX_NEIGHBORS))
+        #a filter or range that matches nothing leaves nothing to re-rank
+        if candidates.shape[1] == 0:
+            return candidates
+
+        start = time.perf_counter()
+        queries = self.user_matrix(list_of_answers, model)
+        to_query, pairwise = candidate_distances(queries, model.scaled_x, candidates)
+        if blend and model.cooccurrence is not None:
+            scores = model.cooccurrence.scores(self.cooccurrence_seeds(model, candidates, liked), candidates)
+            to_query = boost_distances(to_query, relative_scores(scores), blend)
+        if quality and model.review_quality is not None:
+            to_query = boost_distances(to_query, model.review_quality[candidates], quality)
+        picked = mmr(to_query, pairwise, offset + k, diversity or 0)
+        METRICS.lap(self.name, 'rerank', start)
+
+        return np.take_along_axis(candidates, picked, axis=1)[:, offset:]
+
+    #the page of neighbour rows for each set of answers, diversity (0..1) turns on the mmr re-ranker,
+    #blend (0..1) the favorites co-occurrence, liked are ids the user favorited,
+    #and quality (0..1) the review scores
+    def ranked_neighbors(self, list_of_answers, model, filters=None, ranges=None, k=N_NEIGHBORS, offset=0, diversity=None, blend=None, liked=None, quality=None):
+        if diversity or blend or quality:
+            return self.reranked_neighbors(list_of_answers, model, filters, ranges, k, offset, diversity, blend, liked, quality)
+        return self.batch_neighbors(list_of_answers, model, filters, ranges, k, offset)
+
+    #"contributions" member of every neighbour: the share of its distance from the user each of
+    #the explain features accounts for, from the page's k x d block of scaled vectors in one pass
+    def explanations(self, list_of_answers, model, indices):
+        start = time.perf_counter()
+        queries = self.user_matrix(list_of_answers, model)
+        shares = contributions(queries, model.scaled_x, indices, feature_groups(tuple(model.cols), tuple(self.explain_features)))
+        members = contribution_members(self.explain_features, shares)
+        METRICS.lap(self.name, 'explain', start)
+        return members
+
+    #generates recommendation
+    #returns the records and the model version they were served from, explain=True adds each one's contributions
+    def recommend(self, user_ans, filters=None, ranges=None, k=N_NEIGHBORS, offset=0, diversity=None, blend=None, liked=None, quality=None, explain=False):
+        body, version = self.recommend_json(user_ans, filters, ranges, k, offset, diversity, blend, liked, quality, explain)
+        return json.loads(body), version
+
+    #same as recommend but returns the response body as json text, spliced from the pre-encoded records
+    #repeated answer sets are served from the response cache of the live model
+    def recommend_json(self, user_ans, filters=None, ranges=None, k=N_NEIGHBORS, offset=0, diversity=None, blend=None, liked=None, quality=None, explain=False):
+        #grab the version once so a concurrent swap can't mix two catalogs in one answer
+        model = self.slot.get()
+        key = cache_key(model.answer_matrix.encode([user_ans]), filters, ranges, k, offset, diversity, blend, liked, quality, explain)
+        body = self.cache.get(model, key)
+        if body is not None:
+            return body, model.version
+
+        indices = self.ranked_neighbors([user_ans], model, filters, ranges, k, offset, diversity, blend, liked, quality)
+        extras = self.explanations([user_ans], model, indices)[0] if explain else None
+        start = time.perf_counter()
+        body = model.records.json(indices[0], extras)
+        METRICS.lap(self.name, 'serialize', start)
+        self.cache.put(model, key, body)
+        return body, model.version
+
+    #generates recommendations for many sets of answers with one table lookup and one knn query
+    def recommend_batch(self, list_of_answers, filters=None, ranges=None, k=N_NEIGHBORS, offset=0, diversity=None, blend=None, liked=None, quality=None, explain=False):
+        model = self.slot.get()
+        if len(list_of_answers) == 0:
+            return [], model.version
+
+        indices = self.ranked_neighbors(list_of_answers, model, filters, ranges, k, offset, diversity, blend, liked, quality)
+        extras = self.explanations(list_of_answers, model, indices) if explain else [None] * len(indices)
+        start = time.perf_counter()
+        rec = [model.records.records(row, extra) for row, extra in zip(indices, extras)]
+        METRICS.lap(self.name, 'serialize', start)
+        return rec, model.version
+
+    def recommend_batch_json(self, list_of_answers, filters=None, ranges=None, k=N_NEIGHBORS, offset=0, diversity=None, blend=None, liked=None, quality=None, explain=False):
+        model = self.slot.get()
+        if len(list_of_answers) == 0:
+            return '[]', model.version
+
+        indices = self.ranked_neighbors(list_of_answers, model, filters, ranges, k, offset, diversity, blend, liked, quality)
+        extras = self.explanations(list_of_answers, model, indices) if explain else [None] * len(indices)
+        start = time.perf_counter()
+        body = '[' + ','.join(model.records.json(row, extra) for row, extra in zip(indices, extras)) + ']'
+        METRICS.lap(self.name, 'serialize', start)
+        return body, model.version
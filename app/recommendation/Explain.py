@@ -0,0 +1,30 @@
+from functools import lru_cache
+import numpy as np
+
+
+#0/1 matrix summing the feature columns into groups: a group is a column or the category
+#its one-hot columns came from ('balance' sums 'balance_Head-heavy', 'balance_Head-light', ...)
+#cols and groups are tuples, the matrix is built once per catalog layout
+@lru_cache(maxsize=16)
+def feature_groups(cols, groups):
+    matrix = np.zeros((len(cols), len(groups)))
+    for i, col in enumerate(cols):
+        for j, group in enumerate(groups):
+            if col == group or col.startswith(group + '_'):
+                matrix[i, j] = 1
+    return matrix
+
+
+#share of each neighbour's squared distance that every group accounts for, (queries x k x groups)
+#the squared differences of the whole k x d block are summed into groups by one matrix product,
+#features outside the groups make up the rest of the distance
+def contributions(queries, scaled_x, indices, group_matrix):
+    squared = (scaled_x[indices] - queries[:, None, :]) ** 2
+    total = squared.sum(axis=2, keepdims=True)
+    return np.divide(squared @ group_matrix, total, out=np.zeros(indices.shape + (group_matrix.shape[1],)), where=total > 0)
+
+
+#"contributions":{...} json member of every neighbour, to splice into its record
+def contribution_members(groups, shares):
+    keys = ['"' + group + '":' for group in groups]
+    return [['"contributions":{' + ','.join(key + f'{share:.4f}' for key, share in zip(keys, row)) + '}' for row in query] for query in shares.tolist()]
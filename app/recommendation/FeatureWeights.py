@@ -0,0 +1,39 @@
+import copy
+import numpy as np
+from Snapshot import load_snapshot, save_snapshot
+
+
+#weight of every feature column: its own entry, else the entry of the category it was
+#one-hot encoded from ('balance' covers 'balance_Head-heavy'), else 1
+def weight_vector(cols, weights):
+    values = []
+    for col in cols:
+        if col in weights:
+            values.append(weights[col])
+        else:
+            values.append(next((weights[name] for name in weights if col.startswith(name + '_')), 1.0))
+
+    values = np.array(values, dtype=float)
+    if (values <= 0).any():
+        raise ValueError(f"Feature weights must be positive, got {dict(zip(cols, values.tolist()))}")
+    return values
+
+
+#folds per-feature weights into a fitted scaler and the matrix it scaled:
+#dividing scale_ by a weight stretches that axis, so with weight 2 a one standard deviation difference
+#counts like two in the euclidean distance, for catalog rows and user vectors alike, at no query cost
+#previous are the weights already folded in, only the ratio is applied so nothing is re-standardized
+def apply_weights(scale, scaled_x, weights, previous=None):
+    ratio = weights if previous is None else weights / np.asarray(previous, dtype=float)
+    scale = copy.deepcopy(scale)
+    scale.scale_ = scale.scale_ / ratio
+    return scale, np.asarray(scaled_x) * ratio
+
+
+#rescales a snapshot built with other weights and saves it as a new version, the catalog isn't re-parsed
+def reweight_snapshot(name, snap, weights):
+    if np.array_equal(snap['weights'], weights):
+        return snap
+    scale, scaled_x = apply_weights(snap['scale'], snap['scaled_x'], weights, snap['weights'])
+    save_snapshot(name, snap['catalog'], snap['cols'], scale, snap['x'], scaled_x, weights)
+    return load_snapshot(name)
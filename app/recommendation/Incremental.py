@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+
+#replaces the catalog rows whose key is already there, appends the new ones and drops the removed keys
+#the rows left keep their order, moved maps every old position to its new one (-1 for a dropped row)
+#so neighbour rows stored against the old catalog can be carried over
+#x and scaled_x are merged side by side, so the raw features of untouched rows are stored as they were
+#returns the merged catalog, raw and scaled matrices, the positions of every changed row and moved
+def merge_rows(catalog, x, scaled_x, changed, changed_x, changed_scaled_x, key, removed=()):
+    size = len(catalog)
+    position = pd.Series(np.arange(size), index=catalog[key].to_numpy())
+    found = changed[key].map(position)
+    existing = found.notna().to_numpy()
+    kept = ~catalog[key].isin(removed).to_numpy()
+
+    #everything is taken from the old rows followed by the changed ones
+    take = np.arange(size)
+    take[found[existing].to_numpy(dtype=np.int64)] = size + np.flatnonzero(existing)
+    take = np.concatenate([take[kept], size + np.flatnonzero(~existing)])
+
+    moved = np.full(size, -1, dtype=np.int64)
+    moved[kept] = np.arange(kept.sum())
+
+    changed = changed.reindex(columns=catalog.columns)
+    catalog = pd.concat([catalog, changed], ignore_index=True).iloc[take].reset_index(drop=True)
+    x = np.vstack([x, changed_x])[take]
+    scaled_x = np.vstack([scaled_x, changed_scaled_x])[take]
+    return catalog, x, scaled_x, np.flatnonzero(take >= size), moved
+
+
+#how far the catalog has moved from the statistics the scaler was fitted on,
+#in standard deviations: 0 means refitting would give back the same scaler
+def scaler_drift(scale, scaled_x):
+    #a feature's fitted spread in scaled units is its weight, constant columns keep a 0 spread
+    fitted_std = np.sqrt(scale.var_) / scale.scale_
+    unit = np.where(fitted_std > 0, fitted_std, 1)
+    mean_drift = (np.abs(scaled_x.mean(axis=0)) / unit).max()
+    std_drift = (np.abs(scaled_x.std(axis=0) - fitted_std) / unit).max()
+    return float(max(mean_drift, std_drift))
@@ -0,0 +1,173 @@
+import os
+import numpy as np
+from sklearn.neighbors import KDTree, BallTree
+from sklearn.cluster import MiniBatchKMeans
+
+#which exact backend build_index uses, pick it from `python Benchmark.py --index`
+KNN_BACKEND = os.environ.get('RECOMMENDATION_KNN_BACKEND', 'brute')
+
+#upper bound on the (queries x catalog) distance block the brute force backend holds at once
+BLOCK_ELEMENTS = 1 << 22
+
+#catalogs at least this big get the approximate ivf index instead of KNN_BACKEND, 0 never switches
+#off by default: with ~10 features kd_tree still beats ivf at 1M rows, see `python Benchmark.py --ann`
+ANN_THRESHOLD = int(os.environ.get('RECOMMENDATION_ANN_THRESHOLD', 0))
+
+#ivf knobs: more probed cells raise recall and latency together, 0 cells means sqrt(catalog size)
+IVF_CELLS = int(os.environ.get('RECOMMENDATION_IVF_CELLS', 0))
+IVF_PROBE = int(os.environ.get('RECOMMENDATION_IVF_PROBE', 8))
+
+
+#sorted window [start, end) of each row of dist, by distance then column
+#argpartition pins ranks start and end-1, so only the window itself gets sorted whatever the offset
+#rows tied with the window's first or last distance may sit on either side of it, so those are pulled
+#in as well and the window is cut from the (distance, column) order by rank, the same one any page gets
+def ranked_window(dist, start, end):
+    kth = [start, end - 1] if start > 0 else [end - 1]
+    part = np.argpartition(dist, kth, axis=1)[:, start:end]
+    part_dist = np.take_along_axis(dist, part, axis=1)
+
+    low = part_dist.min(axis=1, keepdims=True)
+    high = part_dist.max(axis=1, keepdims=True)
+    tied = ((dist >= low) & (dist <= high)).sum(axis=1)
+    if (tied > end - start).any():
+        #every row at a distance inside the window's range, farther ones pushed to the back
+        width = int(tied.max())
+        inside = np.where((dist >= low) & (dist <= high), dist, np.inf)
+        part = np.argpartition(inside, width - 1, axis=1)[:, :width]
+        part_dist = np.take_along_axis(inside, part, axis=1)
+        first = start - (dist < low).sum(axis=1)
+    else:
+        first = np.zeros(len(dist), dtype=np.int64)
+
+    #ties go to the lower column so results don't depend on argpartition's internals
+    order = np.lexsort((part, part_dist), axis=1)
+    order = np.take_along_axis(order, first[:, None] + np.arange(end - start), axis=1)
+    return np.take_along_axis(part_dist, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+
+#clamps the page offset..offset+k to the rows available
+def window_bounds(k, offset, size):
+    end = min(offset + k, size)
+    return min(offset, end), end
+
+
+#exact euclidean search with one matrix product per block of queries
+#|q - x|^2 = |q|^2 - 2 q.x + |x|^2, with |x|^2 computed once at build time
+class BruteForceIndex:
+    def __init__(self, x):
+        self.x = np.ascontiguousarray(x, dtype=float)
+        self.sq_norms = np.einsum('ij,ij->i', self.x, self.x)
+
+    #the neighbours ranked offset .. offset+k-1, offset=0 is the usual k nearest
+    def kneighbors(self, queries, k, offset=0):
+        queries = np.atleast_2d(np.asarray(queries, dtype=float))
+        start, end = window_bounds(k, offset, len(self.x))
+        block = max(1, BLOCK_ELEMENTS // max(1, len(self.x)))
+
+        distances = np.empty((len(queries), end - start))
+        indices = np.empty((len(queries), end - start), dtype=np.int64)
+        if end == start:
+            return distances, indices
+
+        for first in range(0, len(queries), block):
+            q = queries[first:first + block]
+            d2 = self.sq_norms - 2 * (q @ self.x.T) + np.einsum('ij,ij->i', q, q)[:, None]
+            np.maximum(d2, 0, out=d2)
+
+            window_d2, window = ranked_window(d2, start, end)
+            indices[first:first + block] = window
+            distances[first:first + block] = np.sqrt(window_d2)
+
+        return distances, indices
+
+
+#sklearn's tree indexes behind the same kneighbors(queries, k, offset) call
+#a tree can't skip the first offset neighbours, so deep pages cost more here than with brute
+class KDTreeIndex:
+    def __init__(self, x, leaf_size=30):
+        self.tree = KDTree(np.asarray(x, dtype=float), leaf_size=leaf_size)
+        self.size = len(x)
+
+    def kneighbors(self, queries, k, offset=0):
+        queries = np.atleast_2d(queries)
+        start, end = window_bounds(k, offset, self.size)
+        if end == start:
+            return np.empty((len(queries), 0)), np.empty((len(queries), 0), dtype=np.int64)
+        distances, indices = self.tree.query(queries, k=end)
+        return distances[:, start:], indices[:, start:]
+
+
+class BallTreeIndex(KDTreeIndex):
+    def __init__(self, x, leaf_size=30):
+        self.tree = BallTree(np.asarray(x, dtype=float), leaf_size=leaf_size)
+        self.size = len(x)
+
+
+#approximate euclidean search with an inverted file over k-means cells:
+#the catalog is clustered into n_cells cells, a query measures its distance to the cell centers,
+#then exact distances only to the rows of its n_probe nearest cells
+class IVFIndex:
+    def __init__(self, x, n_cells=None, n_probe=None, seed=0):
+        self.x = np.ascontiguousarray(x, dtype=float)
+        self.n_cells = min(n_cells or IVF_CELLS or int(np.sqrt(len(self.x))) or 1, len(self.x))
+        self.n_probe = min(n_probe or IVF_PROBE, self.n_cells)
+
+        kmeans = MiniBatchKMeans(n_clusters=self.n_cells, n_init=1, random_state=seed)
+        cells = kmeans.fit_predict(self.x)
+        self.centers = BruteForceIndex(kmeans.cluster_centers_)
+
+        #rows sorted by cell so every cell is one contiguous slice
+        self.order = np.argsort(cells, kind='stable')
+        self.starts = np.searchsorted(cells[self.order], np.arange(self.n_cells + 1))
+
+    def kneighbors(self, queries, k, offset=0):
+        queries = np.atleast_2d(np.asarray(queries, dtype=float))
+        start, end = window_bounds(k, offset, len(self.x))
+        _, probes = self.centers.kneighbors(queries, self.n_probe)
+
+        distances = np.empty((len(queries), end - start))
+        indices = np.empty((len(queries), end - start), dtype=np.int64)
+        if end == start:
+            return distances, indices
+
+        for i, cells in enumerate(probes):
+            rows = np.concatenate([self.order[self.starts[c]:self.starts[c + 1]] for c in cells])
+            #the probed cells can hold fewer rows than the page needs on tiny catalogs, widen to everything
+            if len(rows) < end:
+                rows = np.sort(self.order)
+            else:
+                rows = np.sort(rows)
+            d = np.sqrt(((self.x[rows] - queries[i]) ** 2).sum(axis=1))
+            window_d, window = ranked_window(d[None, :], start, end)
+            distances[i] = window_d[0]
+            indices[i] = rows[window[0]]
+
+        return distances, indices
+
+
+#fraction of returned neighbours that are as close as the exact k-th neighbour
+#counted by distance, catalogs have many identical rows and any of them is a correct answer
+def recall_at_k(index, x, queries, k):
+    approx, _ = index.kneighbors(queries, k)
+    exact, _ = BruteForceIndex(x).kneighbors(queries, k)
+    return float(np.mean(approx <= exact[:, -1:] + 1e-9))
+
+
+INDEX_BACKENDS = {
+    'brute': BruteForceIndex,
+    'kd_tree': KDTreeIndex,
+    'ball_tree': BallTreeIndex,
+    'ivf': IVFIndex,
+}
+
+
+#builds the nearest neighbour index over the scaled catalog
+#large catalogs switch to ivf on their own unless a backend is asked for explicitly
+def build_index(x, backend=None):
+    if backend is None and ANN_THRESHOLD and len(x) >= ANN_THRESHOLD:
+        backend = 'ivf'
+    backend = backend or KNN_BACKEND
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown knn backend {backend!r}, expected one of {sorted(INDEX_BACKENDS)}")
+    return INDEX_BACKENDS[backend](x)
@@ -1,13 +1,34 @@
-from supabase import create_client
-import supabase_env
-import json
 import numpy as np
 import pandas as pd
-from sklearn.neighbors import NearestNeighbors
-from sklearn.preprocessing import StandardScaler
-import re
-
-supabase = create_client(supabase_env.NEXT_PUBLIC_SUPABASE_URL, supabase_env.NEXT_PUBLIC_SUPABASE_ANON_KEY )
+from Standardize import map_unique, contains_any
+from Database import supabase
+from Engine import Recommender
+from Offers import build_offers
+
+#fields of each recommended item in the response
+RESPONSE_COLUMNS = ['name','racket_id', 'price', 'median_price', 'in_stock_price', 'img_url', 'color', 'offers']
+
+#numeric columns that take hard min / max ranges, kept sorted per partition
+RANGE_COLUMNS = ['price', 'weight', 'max_tension']
+
+#columns with their own sub-indexes so hard filters on them cost the same as no filter
+PARTITIONS = ['manufacturer_id', 'in_stock']
+
+SNAPSHOT_NAME = 'racket'
+
+#features whose share of each neighbour's distance is returned when a request asks for explanations
+EXPLAIN_FEATURES = ['weight', 'balance', 'stiffness', 'price', 'max_tension']
+
+#feature importance in the distance, by feature or by the category a one-hot feature came from
+#folded into the stored scaled matrix at build time, changing one rescales the snapshot at the next load
+feature_weights = {
+    "manufacturer_id": 1,
+    "weight": 1,
+    "max_tension": 1,
+    "price": 1,
+    "balance": 1,
+    "stiffness": 1,
+}
 
 #question importance
 question_weights = {
@@ -408,19 +429,26 @@ translation_map = {
     }
 }
 
-#get data from supabase
-racket_supabase = supabase.table('racket').select('*').execute()
-rackets = racket_supabase.data
-racket_df = pd.DataFrame(rackets)
+#hard price window behind each budget answer, applied when a request asks for a strict budget
+budget_ranges = {
+    "Under $50": (None, 50),
+    "$50 - $100": (50, 100),
+    "$100 - $200": (100, 200),
+    "$200+": (200, None),
+}
 
-#get price and merge
-price_supabase = supabase.table('racket_retailer').select('racket_id, price').execute()
-prices = price_supabase.data
-price_df = pd.DataFrame(prices)
-price_df= price_df.drop_duplicates(subset='racket_id', keep='first')
-racket_df = racket_df.merge(price_df, on='racket_id', how='left')
-racket_df = racket_df.drop_duplicates(subset='racket_id')
-racket_df = racket_df.drop_duplicates(subset='name', keep='first')
+#every retailer offer of the fetched rackets, folded into one offer index entry per racket
+#price is the cheapest offer, a racket is in stock when any retailer has it
+def add_offers(racket_df, racket_ids=None):
+    offer_query = supabase.table('racket_retailer').select('racket_id, retailer_id, price, in_stock, product_url, retailer(name)')
+    if racket_ids is not None:
+        offer_query = offer_query.in_('racket_id', list(racket_ids))
+    offer_supabase = offer_query.execute()
+    offer_df = build_offers(pd.DataFrame(offer_supabase.data, columns=['racket_id', 'retailer_id', 'price', 'in_stock', 'product_url', 'retailer']))
+
+    racket_df = racket_df.merge(offer_df, on='racket_id', how='left')
+    racket_df['offers'] = [o if isinstance(o, list) else [] for o in racket_df['offers']]
+    return racket_df
 
 #standardizes the racket database
 def standardizer(df):
@@ -435,89 +463,66 @@ def standardizer(df):
         4:82,
         5:77
     }
+    #each std_ function works on the distinct raw values, map_unique spreads them over the rows
     def std_weight(col):
-        if pd.isna(col):
-            return None
-        val = re.search(r'(\d+)U', str(col))
-        if val:
-            n = int(val.group(1))
-            return grams.get(n, 84)
-
-        gval = re.search(r'(\d+)', str(col))
-        if gval:
-            return int(gval.group(1))
+        text = col.astype(str)
+        units = text.str.extract(r'(\d+)U', expand=False)
+        digits = text.str.extract(r'(\d+)', expand=False)
 
+        return np.select(
+            [units.notna(), digits.notna()],
+            [units.astype(float).map(grams).fillna(84), digits.astype(float)],
+            default=85
+        )
 
-        return 85
-    df['weight'] = df['weight'].apply(std_weight)
+    df['weight'] = map_unique(df['weight'], std_weight, np.nan)
 
     #stiffness
     def std_stiffness(col):
 
-        if pd.isna(col):
-            return None
-
-        x = str(col).lower().strip()
+        x = col.astype(str).str.lower().str.strip()
 
         flexible = ['flexible', 'hi-flex', 'soft', 's○○○○●f', 's○○○●○f']
         stiff = ['stiff', 'extra stiff', 'hard', 'slightly stiff', 's ○●○○○ f', 's●○○○○f', 's○●○○○f']
         medium = ['S○○●○○F', 'medium']
 
-        if any(i in x for i in flexible):
-            return 'Flexible'
-
-        if any(i in x for i in medium):
-            return 'Medium'
-
-        if any(i in x for i in stiff):
-            return 'Stiff'
-
-        return None
+        return np.select(
+            [contains_any(x, flexible), contains_any(x, medium), contains_any(x, stiff)],
+            np.array(['Flexible', 'Medium', 'Stiff'], dtype=object),
+            default=None
+        )
 
-    df['stiffness'] = df['stiffness'].apply(std_stiffness)
+    df['stiffness'] = map_unique(df['stiffness'], std_stiffness)
 
     #balance
 
     def std_balance(col):
 
-        if pd.isna(col):
-            return None
-
-
-        x = str(col).lower().strip()
+        x = col.astype(str).str.lower().str.strip()
 
         heavy = ['head heavy', 'head-heavy', 'power']
         even = ['even', 'balance']
         light = ['head light', 'head-light']
 
-        if any(i in x for i in even):
-            return 'Even Balance'
-
-        if any(i in x for i in heavy ):
-            return 'Head-heavy'
-
-        if any(i in x for i in light ):
-            return 'Head-light'
-
-        if 'mm' in x:
-            mm = re.search(r'(\d+)', x)
-            if mm:
-                val = int(mm.group(1))
-                if val >= 305:
-                    return 'Head-heavy'
-                elif val <= 295:
-                    return 'Head-light'
-                else:
-                    return 'Even Balance'
-
-
-
+        #balance point in mm, only used when nothing above matched
+        mm = x.str.extract(r'(\d+)', expand=False).astype(float).to_numpy()
+        has_mm = x.str.contains('mm', regex=False).to_numpy(dtype=bool) & ~np.isnan(mm)
 
+        return np.select(
+            [
+                contains_any(x, even),
+                contains_any(x, heavy),
+                contains_any(x, light),
+                has_mm & (mm >= 305),
+                has_mm & (mm <= 295),
+                has_mm,
+            ],
+            np.array(['Even Balance', 'Head-heavy', 'Head-light', 'Head-heavy', 'Head-light', 'Even Balance'], dtype=object),
+            default=None
+        )
 
-        return None
 
-
-    df['balance'] = df['balance'].apply(std_balance)
+    df['balance'] = map_unique(df['balance'], std_balance)
 
     df['max_tension'] = df['max_tension'].fillna(27)
     df['weight'] = df['weight'].fillna(85)
@@ -525,6 +530,7 @@ def standardizer(df):
     df['stiffness'] = df['stiffness'].fillna('Medium')
     df['price'] = df['price'].fillna(140)
     df['manufacturer_id'] = df['manufacturer_id'].fillna(0)
+    df['in_stock'] = df['in_stock'].fillna(False).astype(bool)
 
 
 
@@ -532,58 +538,49 @@ def standardizer(df):
     return df
 
 
-racket_df = standardizer(racket_df)
-
-
-
 #prepare information for training
-excludes = ['racket_id', 'name', 'color', 'availability', 'description', 'img_url']
+excludes = ['racket_id', 'name', 'color', 'availability', 'description', 'img_url', 'in_stock', 'median_price', 'in_stock_price', 'offers']
 
 col_categories = ['balance', 'stiffness']
-col_onehot = pd.get_dummies(racket_df, columns=col_categories)
-
-cols = [ i for i in col_onehot if i not in excludes]
-
-scale = StandardScaler()
-
-x = col_onehot[cols].values
-
-scaled_x = scale.fit_transform(x)
 
-#knn model
-knn = NearestNeighbors(n_neighbors=3, metric='euclidean')
-knn.fit(scaled_x)
+#the racket catalog on the shared engine, the names below are what the service and scripts call
+engine = Recommender(
+    name=SNAPSHOT_NAME,
+    key='racket_id',
+    standardize=standardizer,
+    categories=col_categories,
+    excludes=excludes,
+    baseline=baseline,
+    translation_map=translation_map,
+    question_weights=question_weights,
+    feature_weights=feature_weights,
+    response_columns=RESPONSE_COLUMNS,
+    range_columns=RANGE_COLUMNS,
+    partitions=PARTITIONS,
+    explain_features=EXPLAIN_FEATURES,
+    enrich=add_offers,
+    favorites='favorites',
+    reviews='review',
+)
+
+model_slot = engine.slot
+fetch_rackets = engine.fetch
+build_catalog = engine.build_catalog
+refresh_snapshot = engine.refresh_snapshot
+refresh_cooccurrence = engine.refresh_cooccurrence
+refresh_reviews = engine.refresh_reviews
+assemble_model = engine.assemble_model
+build_model = engine.build_model
+update_rackets = engine.update
+update_reviews = engine.update_reviews
+load_model = engine.load_model
+reload_model = engine.reload_model
+get_rec = engine.recommend
+get_rec_json = engine.recommend_json
+get_rec_batch = engine.recommend_batch
+get_rec_batch_json = engine.recommend_batch_json
 
 
 #creates user vector from user answers
-def user_vector(user_ans):
-
-    vec = np.array([baseline.get(col, 0) for col in cols], dtype=float)
-    col_index = {k: i for i, k in enumerate(cols)}
-
-    for question, answer in user_ans.items():
-        if question not in translation_map:
-            continue
-
-        if answer not in translation_map[question]:
-            continue
-
-        metrics = translation_map[question][answer].get("metrics", {})
-        weight = question_weights.get(question, 1)
-
-        for key_metric, value_metric in metrics.items():
-            if key_metric in col_index:
-                index = col_index[key_metric]
-                vec[index] += weight * value_metric
-
-    vec = vec.reshape(1, -1)
-    scaled = scale.transform(vec)
-    return scaled
-
-#generates recommendation
-def get_rec(user_ans):
-    scaled_user = user_vector(user_ans)
-    distances, indices = knn.kneighbors(scaled_user)
-    rec = racket_df.iloc[indices[0]][['name','racket_id', 'price', 'img_url', 'color']].to_dict(orient='records')
-    return rec
-
+def user_vector(user_ans, model):
+    return engine.user_matrix([user_ans], model)
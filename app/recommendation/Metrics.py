@@ -0,0 +1,120 @@
+import threading
+import time
+from bisect import bisect_left
+
+#upper bounds of the latency histogram buckets in seconds, +Inf is implied
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+#latency histogram in the prometheus layout, one counter per bucket plus sum and count
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    #prometheus buckets are cumulative, le="0.001" counts everything up to a millisecond
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            total += count
+            yield ('+Inf' if bound == float('inf') else repr(bound)), total
+
+
+def labels(**values):
+    return '{' + ','.join(f'{k}="{v}"' for k, v in values.items()) + '}'
+
+
+#per stage latency histograms and request counters of the recommendation service
+#recording is a dict lookup and a few additions under a lock, cheap enough to leave on
+class Metrics:
+    def __init__(self):
+        self.stages = {}
+        self.requests = {}
+        self.latency = {}
+        self.lookups = {}
+        self.lock = threading.Lock()
+
+    def observe(self, catalog, stage, seconds):
+        with self.lock:
+            key = (catalog, stage)
+            if key not in self.stages:
+                self.stages[key] = Histogram()
+            self.stages[key].observe(seconds)
+
+    #records the time since start under stage and returns now, so stages chain:
+    #start = METRICS.lap('racket', 'knn', start)
+    def lap(self, catalog, stage, start):
+        now = time.perf_counter()
+        self.observe(catalog, stage, now - start)
+        return now
+
+    def request(self, endpoint, status, seconds):
+        with self.lock:
+            key = (endpoint, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if endpoint not in self.latency:
+                self.latency[endpoint] = Histogram()
+            self.latency[endpoint].observe(seconds)
+
+    #one response cache lookup of a catalog, hit or miss
+    def cache(self, catalog, hit):
+        with self.lock:
+            key = (catalog, 'hit' if hit else 'miss')
+            self.lookups[key] = self.lookups.get(key, 0) + 1
+
+    #prometheus text exposition format, slots gives the live model of each catalog for the catalog gauges
+    def render(self, slots):
+        lines = []
+        with self.lock:
+            lines.append('# HELP recommendation_stage_seconds Time spent in each stage of answering a recommendation.')
+            lines.append('# TYPE recommendation_stage_seconds histogram')
+            for (catalog, stage), histogram in sorted(self.stages.items()):
+                lines.extend(histogram_lines('recommendation_stage_seconds', histogram, catalog=catalog, stage=stage))
+
+            lines.append('# HELP recommendation_request_seconds Time spent answering each endpoint.')
+            lines.append('# TYPE recommendation_request_seconds histogram')
+            for endpoint, histogram in sorted(self.latency.items()):
+                lines.extend(histogram_lines('recommendation_request_seconds', histogram, endpoint=endpoint))
+
+            lines.append('# HELP recommendation_requests_total Requests answered by endpoint and status.')
+            lines.append('# TYPE recommendation_requests_total counter')
+            for (endpoint, status), count in sorted(self.requests.items()):
+                lines.append(f"recommendation_requests_total{labels(endpoint=endpoint, status=status)} {count}")
+
+            lines.append('# HELP recommendation_cache_lookups_total Response cache lookups by catalog and result.')
+            lines.append('# TYPE recommendation_cache_lookups_total counter')
+            for (catalog, result), count in sorted(self.lookups.items()):
+                lines.append(f"recommendation_cache_lookups_total{labels(catalog=catalog, result=result)} {count}")
+
+        lines.append('# HELP recommendation_catalog_info Catalog version being served, always 1.')
+        lines.append('# TYPE recommendation_catalog_info gauge')
+        models = [(slot.name, slot.current) for slot in slots if slot.current is not None]
+        for name, model in models:
+            lines.append(f"recommendation_catalog_info{labels(catalog=name, version=model.version)} 1")
+        lines.append('# HELP recommendation_catalog_rows Rows in the catalog being served.')
+        lines.append('# TYPE recommendation_catalog_rows gauge')
+        for name, model in models:
+            lines.append(f"recommendation_catalog_rows{labels(catalog=name)} {len(model.catalog)}")
+        lines.append('# HELP recommendation_catalog_built_at_seconds Unix time the served catalog was built.')
+        lines.append('# TYPE recommendation_catalog_built_at_seconds gauge')
+        for name, model in models:
+            lines.append(f"recommendation_catalog_built_at_seconds{labels(catalog=name)} {model.built_at}")
+
+        return '\n'.join(lines) + '\n'
+
+
+def histogram_lines(name, histogram, **label_values):
+    for bound, count in histogram.cumulative():
+        yield f"{name}_bucket{labels(**label_values, le=bound)} {count}"
+    yield f"{name}_sum{labels(**label_values)} {histogram.sum}"
+    yield f"{name}_count{labels(**label_values)} {histogram.count}"
+
+
+#one registry for the whole process, the recommenders record into it and /metrics renders it
+METRICS = Metrics()
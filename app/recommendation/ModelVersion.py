@@ -0,0 +1,180 @@
+import json
+import math
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+from Snapshot import read_meta
+
+#one fully built model, never mutated after it is created
+#partitions holds the filtered sub-indexes, answer_matrix the compiled questionnaire
+#and answers the precomputed AnswerTable (None when not built)
+#records holds each row's response, pre-encoded and aligned with the index
+#cooccurrence the favorites co-occurrence lined up with the catalog (None when there is none)
+#and review_quality each row's smoothed review score in 0..1 (None when there are no review aggregates)
+ModelVersion = namedtuple('ModelVersion', ['version', 'built_at', 'catalog', 'cols', 'scale', 'scaled_x', 'knn', 'partitions', 'answer_matrix', 'answers', 'records', 'cooccurrence', 'review_quality'])
+
+
+#every catalog row's response record encoded once per version, NaN already turned into null,
+#so answering a request is a gather instead of iloc + to_dict + clean_nan
+#the encoded records are one utf-8 blob plus row offsets, memory mapped from the artifact when there is one
+class ResponseRecords:
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    #json array of the records at indices, spliced together without re-encoding
+    #extras holds one more json member per record, e.g. '"contributions":{...}', spliced in before its closing brace
+    def json(self, indices, extras=None):
+        records = (bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8') for i in indices)
+        if extras is not None:
+            records = (record[:-1] + ',' + extra + '}' for record, extra in zip(records, extras))
+        return '[' + ','.join(records) + ']'
+
+    #the same records as python dicts
+    def records(self, indices, extras=None):
+        return json.loads(self.json(indices, extras))
+
+
+#each row's record as compact json bytes
+def encode_records(catalog, columns):
+    encoded = []
+    for row in catalog[columns].to_dict(orient='records'):
+        record = {k: None if isinstance(v, float) and math.isnan(v) else v for k, v in row.items()}
+        #keys sorted like flask's jsonify sorts them, so clients see the same records as before
+        encoded.append(json.dumps(record, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+    return encoded
+
+
+#the records kept in the artifact when there is one
+def stored_records(blob, offsets, artifact):
+    if artifact is None:
+        return ResponseRecords(blob, offsets)
+    artifact.save('records', blob)
+    artifact.save('records-offsets', offsets)
+    return ResponseRecords(artifact.load('records'), artifact.load('records-offsets'))
+
+
+def response_records(catalog, columns, artifact=None):
+    if artifact is not None and artifact.exists('records') and artifact.exists('records-offsets'):
+        return ResponseRecords(artifact.load('records'), artifact.load('records-offsets'))
+
+    encoded = encode_records(catalog, columns)
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    offsets = np.cumsum([0] + [len(r) for r in encoded])
+    return stored_records(blob, offsets, artifact)
+
+
+#the records of a catalog that had the rows at `rows` changed or appended and the rest moved by `moved`
+#(old position -> new one, -1 for a dropped row): only the changed rows are encoded,
+#every other record is copied as bytes from the previous version, one slice per run of untouched rows
+def patch_records(records, catalog, columns, rows, moved, artifact=None):
+    size = len(catalog)
+    source = np.full(size, -1, dtype=np.int64)
+    kept = np.flatnonzero(moved >= 0)
+    source[moved[kept]] = kept
+    source[rows] = -1
+
+    encoded = encode_records(catalog.iloc[rows], columns)
+    old_offsets = np.asarray(records.offsets, dtype=np.int64)
+    lengths = np.where(source >= 0, np.diff(old_offsets)[np.maximum(source, 0)], 0)
+    lengths[rows] = [len(r) for r in encoded]
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    blob = np.empty(offsets[-1], dtype=np.uint8)
+    untouched = source >= 0
+    #a run goes on while the next row is the next record of the previous version too
+    continues = np.concatenate([[False], untouched[1:] & untouched[:-1] & (source[1:] == source[:-1] + 1)])
+    starts = np.flatnonzero(untouched & ~continues)
+    ends = np.flatnonzero(untouched & ~np.concatenate([continues[1:], [False]])) + 1
+    for start, end in zip(starts, ends):
+        blob[offsets[start]:offsets[end]] = records.blob[old_offsets[source[start]]:old_offsets[source[end - 1] + 1]]
+    for row, record in zip(rows, encoded):
+        blob[offsets[row]:offsets[row + 1]] = np.frombuffer(record, dtype=np.uint8)
+
+    return stored_records(blob, offsets, artifact)
+
+
+#holds the model version currently being served and swaps in rebuilt ones
+class ModelSlot:
+    #stamp() identifies on-disk data that changes without a new catalog version, like the favorites
+    #co-occurrence, and extend(model) loads it into a model, the reloader calls it whenever the stamp moves
+    def __init__(self, name, build, stamp=None, extend=None):
+        self.name = name
+        self.build = build
+        self.stamp = stamp or (lambda: None)
+        self.extend = extend
+        self.current = None
+        #the stamp of the data the live version was built with
+        self.stamped = None
+        #serializes builds, readers never take it
+        self.lock = threading.Lock()
+
+    #returns the live version, building it on first use
+    def get(self):
+        model = self.current
+        if model is None:
+            with self.lock:
+                if self.current is None:
+                    stamp = self.stamp()
+                    self.current = self.build(refresh=False)
+                    self.stamped = stamp
+                model = self.current
+        return model
+
+    #builds the next version off the request path then swaps it in with one assignment
+    #refresh=True pulls the catalog from supabase first, by default the snapshot on disk is loaded
+    def reload(self, refresh=False):
+        with self.lock:
+            stamp = self.stamp()
+            model = self.build(refresh=refresh)
+            self.current = model
+            self.stamped = stamp
+            return model
+
+    #derives the next version from the live one, e.g. by folding in a few changed rows
+    #change returns None when it can't, and the slot falls back to a full rebuild
+    def update(self, change):
+        self.get()
+        with self.lock:
+            model = change(self.current)
+            if model is None:
+                model = self.build(refresh=True)
+            self.current = model
+            #change may have written the stamped data itself
+            self.stamped = self.stamp()
+            return model
+
+    #reloads the stamped data into the live version when it changed on disk since that version was built
+    def follow(self):
+        self.get()
+        with self.lock:
+            stamp = self.stamp()
+            if stamp == self.stamped or self.extend is None:
+                return self.current
+            self.current = self.extend(self.current)
+            self.stamped = stamp
+            return self.current
+
+
+#follows the snapshot pointers in a daemon thread: a slot is reloaded from disk only when its pointer
+#moved to a version it isn't serving, saved by RefreshCatalog.py or by another worker's update,
+#otherwise its stamped data is followed
+#supabase is never queried here, a failed reload keeps the old version serving
+def start_reloader(slots, interval):
+    def loop():
+        while True:
+            time.sleep(interval)
+            for slot in slots:
+                try:
+                    meta = read_meta(slot.name)
+                    if meta is not None and slot.current is not None and meta.get('version') != slot.current.version:
+                        slot.reload(refresh=False)
+                    elif slot.current is not None:
+                        slot.follow()
+                except Exception as e:
+                    print(f"Could not reload {slot.name} model: {e}")
+
+    thread = threading.Thread(target=loop, name='model-reloader', daemon=True)
+    thread.start()
+    return thread
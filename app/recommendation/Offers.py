@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+#what each retailer offer carries in the response
+OFFER_COLUMNS = ['retailer', 'price', 'in_stock', 'product_url']
+
+
+#retailer name out of the embedded `retailer(name)` select, the retailer id when the join is missing
+def retailer_name(retailer, retailer_id):
+    if isinstance(retailer, dict) and retailer.get('name'):
+        return retailer['name']
+    return None if pd.isna(retailer_id) else retailer_id
+
+
+#per racket offer index from the racket_retailer rows, built with one sort and one grouping:
+#cheapest price, median price, cheapest in-stock price, whether any retailer has it in stock,
+#and every offer cheapest first so the frontend doesn't have to fetch them per racket
+def build_offers(retailer_df):
+    df = retailer_df.copy()
+    df['price'] = pd.to_numeric(df['price'], errors='coerce')
+    df['in_stock'] = df['in_stock'].fillna(False).astype(bool)
+    df['retailer'] = [retailer_name(r, i) for r, i in zip(df['retailer'], df['retailer_id'])]
+
+    #one sort puts each racket's offers together and cheapest first, unpriced offers last
+    df = df.sort_values(['racket_id', 'price'], kind='stable', na_position='last', ignore_index=True)
+    df['in_stock_price'] = df['price'].where(df['in_stock'])
+
+    groups = df.groupby('racket_id', sort=False)
+    offers = groups.agg(
+        price=('price', 'min'),
+        median_price=('price', 'median'),
+        in_stock_price=('in_stock_price', 'min'),
+        in_stock=('in_stock', 'any'),
+    )
+
+    #rows are sorted by racket, so each racket's offers are one contiguous slice
+    records = df[OFFER_COLUMNS].astype(object).where(df[OFFER_COLUMNS].notna(), None).to_dict(orient='records')
+    ends = np.cumsum(groups.size().to_numpy())
+    starts = ends - groups.size().to_numpy()
+    offers['offers'] = [records[start:end] for start, end in zip(starts, ends)]
+
+    return offers.reset_index()
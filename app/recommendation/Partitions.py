@@ -0,0 +1,90 @@
+from itertools import combinations
+import numpy as np
+from KnnIndex import build_index, BruteForceIndex
+from Ranges import SortedColumns, column_values
+from Snapshot import shared_array
+
+
+#partition keys compare as plain python values, 6, 6.0 and '6' all hit the same manufacturer
+def partition_key(value):
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        if lowered in ('true', 'false'):
+            return lowered == 'true'
+        try:
+            return float(lowered)
+        except ValueError:
+            return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+#hard filters from request query args, only for the columns the catalog is partitioned by
+def parse_filters(args, columns):
+    return {col: partition_key(args[col]) for col in columns if col in args}
+
+
+#one knn sub-index per distinct value of each partition column and of each combination of them,
+#so a filtered query searches only the matching rows instead of over-fetching and dropping.
+#every partition, the whole catalog included, also keeps its range columns sorted for range queries
+#with an artifact each partition's rows and feature matrix are memory mapped from it and shared by the workers
+#previous is the index of the version the catalog was incrementally updated from, changed the rows that
+#changed or were appended and moved the old rows' new positions: a partition without a changed row
+#keeps its sub-index and sorted columns, only its row numbers move
+class PartitionedIndex:
+    def __init__(self, catalog, scaled_x, columns, range_columns, knn, artifact=None, previous=None, changed=None, moved=None):
+        self.columns = list(columns)
+        self.scaled_x = scaled_x
+
+        values = column_values(catalog, range_columns)
+        everything = np.arange(len(catalog))
+        self.partitions = {((), ()): (everything, knn, SortedColumns(values, everything, artifact))}
+
+        for r in range(1, len(self.columns) + 1):
+            for combo in combinations(self.columns, r):
+                groups = catalog.groupby(list(combo), dropna=False).indices
+                for i, (values_key, rows) in enumerate(groups.items()):
+                    values_key = values_key if isinstance(values_key, tuple) else (values_key,)
+                    key = (combo, tuple(partition_key(v) for v in values_key))
+                    name = f"partition-{'-'.join(combo)}-{i}"
+                    kept = previous.partitions.get(key) if previous is not None else None
+                    if kept is not None and not (len(kept[0]) == len(rows) and (moved[kept[0]] == rows).all() and not np.isin(rows, changed).any()):
+                        kept = None
+
+                    rows = shared_array(artifact, name + '-rows', lambda: rows)
+                    if kept is not None:
+                        #the feature matrix is the same, a worker booting this version writes its copy when it needs it
+                        self.partitions[key] = (rows, kept[1], SortedColumns(values, rows, previous=kept[2], moved=moved))
+                        continue
+                    x = shared_array(artifact, name + '-x', lambda: scaled_x[rows])
+                    self.partitions[key] = (rows, build_index(x), SortedColumns(values, rows, artifact, name))
+
+    #neighbours among the rows matching every filter and range, global row numbers like the full index
+    def kneighbors(self, queries, k, filters=None, ranges=None, offset=0):
+        filters = filters or {}
+        unknown = [col for col in filters if col not in self.columns]
+        if unknown:
+            raise ValueError(f"Can't filter on {unknown}, partitioned columns are {self.columns}")
+
+        combo = tuple(col for col in self.columns if col in filters)
+        key = (combo, tuple(partition_key(filters[col]) for col in combo))
+        queries = np.atleast_2d(queries)
+        nothing = np.empty((len(queries), 0)), np.empty((len(queries), 0), dtype=np.int64)
+
+        if key not in self.partitions:
+            return nothing
+        rows, index, sorted_columns = self.partitions[key]
+
+        #ranges narrow the partition to a slice first, distances are only computed over that slice
+        if ranges:
+            rows = sorted_columns.select(ranges)
+            if len(rows) == 0:
+                return nothing
+            index = BruteForceIndex(self.scaled_x[rows])
+
+        distances, local = index.kneighbors(queries, k, offset)
+        return distances, rows[local]
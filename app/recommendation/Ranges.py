@@ -0,0 +1,74 @@
+import numpy as np
+from Snapshot import shared_array
+
+
+#range columns by catalog row as floats, what SortedColumns searches
+def column_values(catalog, columns):
+    return {col: catalog[col].to_numpy(dtype=float) for col in columns}
+
+
+#hard numeric ranges from request query args, e.g. price_max=50&weight_min=80
+#gives {column: (low, high)} with None for an open end, only for the catalog's range columns
+def parse_ranges(args, columns):
+    ranges = {}
+    for col in columns:
+        low = args.get(f"{col}_min")
+        high = args.get(f"{col}_max")
+        if low is None and high is None:
+            continue
+        try:
+            ranges[col] = (None if low is None else float(low), None if high is None else float(high))
+        except ValueError:
+            raise ValueError(f"{col}_min / {col}_max must be numbers")
+    return ranges
+
+
+#range columns of a set of catalog rows, each kept sorted once so a range is two binary searches
+#values holds each column by catalog row, shared by every set of rows over the same catalog
+#with an artifact the sorted arrays are memory mapped from it under key
+#previous reuses the sorted columns of the same untouched rows before the catalog rows moved (old -> new row):
+#moving keeps the rows' order, so only the row numbers change, not the order or its ties
+class SortedColumns:
+    def __init__(self, values, rows, artifact=None, key='all', previous=None, moved=None):
+        self.sorted = {}
+        #unsorted values by catalog row, used to check the other ranges on an already narrowed slice
+        self.values = values
+        if previous is not None:
+            for col, (sorted_values, order) in previous.sorted.items():
+                self.sorted[col] = (sorted_values, moved[order])
+            return
+        for col, col_values in values.items():
+            order = shared_array(artifact, f"{key}-{col}-order", lambda: rows[np.argsort(col_values[rows], kind='stable')])
+            self.sorted[col] = (shared_array(artifact, f"{key}-{col}-sorted", lambda: col_values[order]), order)
+
+    #bounds of the rows inside low..high (inclusive) in the column's sorted order
+    def bounds(self, col, low, high):
+        values, order = self.sorted[col]
+        start = 0 if low is None else np.searchsorted(values, low, side='left')
+        end = len(values) if high is None else np.searchsorted(values, high, side='right')
+        return start, max(start, end)
+
+    #catalog rows satisfying every range: the narrowest column's slice, then the rest checked on it
+    def select(self, ranges):
+        unknown = [col for col in ranges if col not in self.sorted]
+        if unknown:
+            raise ValueError(f"Can't range on {unknown}, range columns are {list(self.sorted)}")
+
+        spans = {col: self.bounds(col, low, high) for col, (low, high) in ranges.items()}
+        narrowest = min(spans, key=lambda col: spans[col][1] - spans[col][0])
+        start, end = spans[narrowest]
+        rows = self.sorted[narrowest][1][start:end]
+
+        for col, (low, high) in ranges.items():
+            if col == narrowest or len(rows) == 0:
+                continue
+            values = self.values[col][rows]
+            keep = np.ones(len(rows), dtype=bool)
+            if low is not None:
+                keep &= values >= low
+            if high is not None:
+                keep &= values <= high
+            rows = rows[keep]
+
+        #back in catalog order so ties break the same way as the unfiltered index
+        return np.sort(rows)
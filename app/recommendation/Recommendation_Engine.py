@@ -1,33 +1,179 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
-from MachineLearning import get_rec
-from StringRecommendation import get_string_rec
-import math
+from MachineLearning import engine as rackets, budget_ranges
+from StringRecommendation import engine as strings
+from Engine import N_NEIGHBORS, MAX_NEIGHBORS
+from Setups import recommend_setups, SETUP_RACKETS, SETUP_STRINGS, MAX_SETUP_CANDIDATES
+from Partitions import parse_filters
+from Ranges import parse_ranges
+from ModelVersion import start_reloader
+from Metrics import METRICS
+import os
+import time
 app= Flask(__name__)
-CORS(app, origins=["http://localhost:3000"])
+CORS(app, origins=["http://localhost:3000"], expose_headers=["X-Model-Version"])
 
-def clean_nan(obj):
-    if isinstance(obj, float) and math.isnan(obj):
+#every catalog served, each one a Recommender over the same engine
+ENGINES = [rackets, strings]
+
+#load the catalog snapshots at boot, run RefreshCatalog.py to pull new data from supabase
+for engine in ENGINES:
+    engine.load_model()
+
+#check the snapshot pointers in the background and load the catalogs RefreshCatalog.py or another
+#worker saved without a restart, supabase is never queried here, 0 disables it
+RELOAD_SECONDS = int(os.environ.get('RECOMMENDATION_RELOAD_SECONDS', 600))
+if RELOAD_SECONDS > 0:
+    start_reloader([engine.slot for engine in ENGINES], RELOAD_SECONDS)
+
+#every request is timed and counted by endpoint and status for /metrics
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    if request.endpoint != 'metrics' and 'start' in g:
+        METRICS.request(request.endpoint or 'unknown', response.status_code, time.perf_counter() - g.start)
+    return response
+
+#bad filter, range or page values in the query string
+@app.errorhandler(ValueError)
+def bad_request(e):
+    return jsonify({"error": str(e)}), 400
+
+#responds with json the recommender already encoded, tagged with the model version it came from
+def json_response(body, version):
+    response = Response(body, mimetype='application/json')
+    response.headers['X-Model-Version'] = version
+    return response
+
+
+#optional 0..1 weight from the query string, None when it isn't given
+def unit_interval(name):
+    value = request.args.get(name)
+    if value is None:
         return None
-    if isinstance(obj, dict):
-        return {k: clean_nan(v) for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [clean_nan(v) for v in obj]
-    return obj
+    try:
+        value = float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number")
+    if not 0 <= value <= 1:
+        raise ValueError(f"{name} must be between 0 and 1")
+    return value
+
+
+#filters, ranges, page and re-ranking of one catalog's ranking, all from the query string
+#e.g. ?manufacturer_id=6&in_stock=true&price_max=100&k=10&offset=10&diversity=0.3
+#blend=0.5 mixes in the favorites co-occurrence, liked=12,40 are the user's favorite ids to take it from,
+#quality=0.3 moves well reviewed items up, explain=true adds each item's feature contributions
+#blend and quality do nothing on a catalog without favorites or reviews,
+#and a page re-ranked by any of them has to end by rank MAX_NEIGHBORS (a 400 otherwise)
+def query_options(engine):
+    try:
+        k = int(request.args.get('k', N_NEIGHBORS))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        raise ValueError("k and offset must be integers")
+    if not 1 <= k <= MAX_NEIGHBORS or offset < 0:
+        raise ValueError(f"k must be between 1 and {MAX_NEIGHBORS} and offset can't be negative")
+
+    liked = request.args.get('liked')
+    try:
+        liked = [int(item_id) for item_id in liked.split(',') if item_id.strip()] if liked else None
+    except ValueError:
+        raise ValueError("liked must be a comma separated list of ids")
+
+    return {
+        'filters': parse_filters(request.args, engine.partitions),
+        'ranges': parse_ranges(request.args, engine.range_columns),
+        'k': k,
+        'offset': offset,
+        #diversity=0.3 re-ranks the page so near-identical variants don't crowd it out
+        'diversity': unit_interval('diversity'),
+        'blend': unit_interval('blend'),
+        'liked': liked,
+        'quality': unit_interval('quality'),
+        'explain': request.args.get('explain', '').lower() in ('1', 'true'),
+    }
 
 
 #routes the data to react
+#strict_budget=true turns the budget answer into a hard price range
 @app.route('/api/recommend', methods = ['POST'])
 def recommend():
     user_ans = request.get_json()
-    rec = get_rec(user_ans)
-    return jsonify(clean_nan(rec))
+    options = query_options(rackets)
+    if request.args.get('strict_budget', '').lower() in ('1', 'true') and user_ans.get('budget') in budget_ranges:
+        options['ranges'].setdefault('price', budget_ranges[user_ans['budget']])
+    body, version = rackets.recommend_json(user_ans, **options)
+    return json_response(body, version)
 
 @app.route('/api/stringrec', methods = ['POST'])
 def recommend_string():
     user_ans = request.get_json()
-    rec = get_string_rec(user_ans)
-    return jsonify(clean_nan(rec))
+    body, version = strings.recommend_json(user_ans, **query_options(strings))
+    return json_response(body, version)
+
+#best racket + string pairs for one questionnaire in one call
+#?rackets=5&strings=5 are the candidates paired up, k the setups returned, racket filters and ranges apply
+@app.route('/api/recommend/setup', methods = ['POST'])
+def recommend_setup():
+    user_ans = request.get_json()
+    try:
+        n = int(request.args.get('rackets', SETUP_RACKETS))
+        m = int(request.args.get('strings', SETUP_STRINGS))
+        k = int(request.args.get('k', N_NEIGHBORS))
+    except ValueError:
+        raise ValueError("rackets, strings and k must be integers")
+    if not 1 <= n <= MAX_SETUP_CANDIDATES or not 1 <= m <= MAX_SETUP_CANDIDATES or k < 1:
+        raise ValueError(f"rackets and strings must be between 1 and {MAX_SETUP_CANDIDATES} and k positive")
+
+    filters = parse_filters(request.args, rackets.partitions)
+    ranges = parse_ranges(request.args, rackets.range_columns)
+    body, version = recommend_setups(user_ans, rackets, strings, n, m, k, filters, ranges)
+    return json_response(body, version)
+
+#scores a list of questionnaires in one call, responds with one list of recommendations per questionnaire
+@app.route('/api/recommend/batch', methods = ['POST'])
+def recommend_batch():
+    list_of_answers = request.get_json()
+    if not isinstance(list_of_answers, list) or not all(isinstance(answers, dict) for answers in list_of_answers):
+        return jsonify({"error": "expected a list of answers, each one an object"}), 400
+    body, version = rackets.recommend_batch_json(list_of_answers, **query_options(rackets))
+    return json_response(body, version)
+
+@app.route('/api/stringrec/batch', methods = ['POST'])
+def recommend_string_batch():
+    list_of_answers = request.get_json()
+    if not isinstance(list_of_answers, list) or not all(isinstance(answers, dict) for answers in list_of_answers):
+        return jsonify({"error": "expected a list of answers, each one an object"}), 400
+    body, version = strings.recommend_batch_json(list_of_answers, **query_options(strings))
+    return json_response(body, version)
+
+#the scrapers post the racket ids they added, changed or removed, those rows are folded into the live model
+#ids supabase and the catalog don't know change nothing
+@app.route('/api/catalog/rackets', methods = ['POST'])
+def update_racket_catalog():
+    racket_ids = (request.get_json() or {}).get('racket_ids')
+    if not isinstance(racket_ids, list) or not racket_ids:
+        return jsonify({"error": "expected a non-empty list of racket_ids"}), 400
+    model = rackets.update(racket_ids)
+    return jsonify({"version": model.version, "size": len(model.catalog)})
+
+#the review api posts the racket ids that got a new or edited review, their aggregates are refreshed
+@app.route('/api/catalog/reviews', methods = ['POST'])
+def update_review_aggregates():
+    racket_ids = (request.get_json() or {}).get('racket_ids')
+    if not isinstance(racket_ids, list) or not racket_ids:
+        return jsonify({"error": "expected a non-empty list of racket_ids"}), 400
+    model = rackets.update_reviews(racket_ids)
+    return jsonify({"version": model.version})
+
+#stage latencies, request counts and the catalogs being served, in prometheus text format
+@app.route('/metrics')
+def metrics():
+    return Response(METRICS.render([engine.slot for engine in ENGINES]), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def message():
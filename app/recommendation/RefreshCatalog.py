@@ -0,0 +1,15 @@
+import MachineLearning
+import StringRecommendation
+
+#rebuilds the co-occurrence matrices from the favorites tables and the review aggregates from the
+#review tables of the catalogs that have them, then pulls every catalog from supabase,
+#rewrites the snapshots and precomputes the answer tables for the new catalog versions
+#the flask workers only read these files and pick up the ones that changed, so run this whenever the catalog changes
+if __name__ == '__main__':
+    for engine in [MachineLearning.engine, StringRecommendation.engine]:
+        #written before the snapshot so a worker following a new pointer loads them with it
+        if engine.favorites:
+            print(f'{engine.name} co-occurrence pairs:', engine.refresh_cooccurrence().nnz)
+        if engine.reviews:
+            print(f'{engine.name} reviewed:', len(engine.refresh_reviews()))
+        print(f'{engine.name} snapshot:', engine.build_model(refresh=True).version)
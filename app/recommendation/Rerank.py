@@ -0,0 +1,60 @@
+import numpy as np
+
+#nearest candidates a re-ranker chooses from, enough to hold several distinct models
+CANDIDATE_POOL = 30
+
+
+#candidates needed to re-rank down to the page offset..offset+k
+def pool_size(k, offset, limit):
+    return min(limit, max(CANDIDATE_POOL, 3 * (offset + k)))
+
+
+#distances from each query to its candidates and between the candidates themselves
+#one (queries x pool x features) block per call, no python loop over candidates
+def candidate_distances(queries, scaled_x, candidates):
+    block = scaled_x[candidates]
+    to_query = np.sqrt(((block - queries[:, None, :]) ** 2).sum(axis=2))
+
+    sq_norms = np.einsum('npd,npd->np', block, block)
+    pairwise = sq_norms[:, :, None] - 2 * np.einsum('npd,nqd->npq', block, block) + sq_norms[:, None, :]
+    return to_query, np.sqrt(np.maximum(pairwise, 0))
+
+
+#maximal marginal relevance: picks candidates one at a time by closeness to the query
+#minus closeness to what was already picked, so colour and weight variants of one model don't fill the page
+#diversity 0 keeps the plain distance order, 1 only spreads the picks out
+#returns the first count picks of every query as positions in its candidate row
+def mmr(to_query, pairwise, count, diversity):
+    n, pool = to_query.shape
+    count = min(count, pool)
+    rows = np.arange(n)
+
+    picked = np.empty((n, count), dtype=np.int64)
+    available = np.ones((n, pool), dtype=bool)
+    #distance to the closest candidate picked so far, no penalty before the first pick
+    nearest = np.zeros((n, pool))
+
+    for step in range(count):
+        score = diversity * nearest - (1 - diversity) * to_query
+        score[~available] = -np.inf
+        choice = score.argmax(axis=1)
+
+        picked[:, step] = choice
+        available[rows, choice] = False
+        nearest = pairwise[rows, choice] if step == 0 else np.minimum(nearest, pairwise[rows, choice])
+
+    return picked
+
+
+#scales each query's scores to 0..1 of its best candidate
+def relative_scores(scores):
+    top = scores.max(axis=1, keepdims=True)
+    return np.divide(scores, top, out=np.zeros(scores.shape), where=top > 0)
+
+
+#moves candidates with a higher 0..1 score towards the front: weight times the score times the spread
+#of the query's candidate distances is taken off, so the result is still a distance mmr can work with
+#and weight 1 lets a candidate scoring 1 overtake one scoring 0 anywhere in the pool
+def boost_distances(to_query, scores, weight):
+    spread = to_query.max(axis=1, keepdims=True) - to_query.min(axis=1, keepdims=True)
+    return to_query - weight * spread * scores
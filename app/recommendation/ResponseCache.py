@@ -0,0 +1,58 @@
+import os
+import threading
+from collections import OrderedDict
+from Metrics import METRICS
+
+#response bodies kept per catalog, least recently used first out, 0 turns the cache off
+CACHE_SIZE = int(os.environ.get('RECOMMENDATION_CACHE_SIZE', 4096))
+
+
+#everything that changes a response: the encoded answers, where unknown questions and answers
+#are already dropped and question order doesn't matter, and every ranking option
+def cache_key(answer_codes, filters, ranges, k, offset, diversity, blend, liked, quality, explain):
+    return (
+        answer_codes.tobytes(),
+        tuple(sorted((filters or {}).items())),
+        tuple(sorted((ranges or {}).items())),
+        k, offset, diversity, blend,
+        tuple(sorted(liked)) if liked else None,
+        quality, explain,
+    )
+
+
+#bounded lru of json response bodies for one catalog, only ever holding responses of one model:
+#the first lookup against a model the slot swapped in empties it, so a new catalog version,
+#folded in rows or refreshed review scores never serve stale records
+#hits and misses are counted on /metrics
+class ResponseCache:
+    def __init__(self, name, size=CACHE_SIZE):
+        self.name = name
+        self.size = size
+        self.model = None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, model, key):
+        if self.size <= 0:
+            return None
+        with self.lock:
+            if model is not self.model:
+                self.entries.clear()
+                self.model = model
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+        METRICS.cache(self.name, body is not None)
+        return body
+
+    def put(self, model, key, body):
+        if self.size <= 0:
+            return
+        with self.lock:
+            #a body computed from a model that was swapped out meanwhile isn't kept
+            if model is not self.model:
+                return
+            self.entries[key] = body
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
@@ -0,0 +1,65 @@
+import os
+import numpy as np
+import pandas as pd
+from Snapshot import SNAPSHOT_DIR, replace_file
+
+#reviews are 1 to 5 stars
+MIN_RATING = 1
+MAX_RATING = 5
+
+#an item's smoothed score starts at the mean of every review and moves to its own mean
+#as its reviews outweigh this many reviews at the overall mean
+PRIOR_REVIEWS = float(os.environ.get('RECOMMENDATION_PRIOR_REVIEWS', 5))
+
+
+def reviews_path(name):
+    return os.path.join(SNAPSHOT_DIR, f'{name}-reviews.npz')
+
+
+#rating sum and count per item, sorted by id, from the (key, rating) rows in one groupby
+def aggregate_reviews(review_df, key):
+    review_df = review_df.dropna(subset=[key, 'rating'])
+    grouped = review_df.groupby(review_df[key].astype(np.int64))['rating'].agg(['sum', 'count']).sort_index()
+    return pd.DataFrame({'total': grouped['sum'].astype(float), 'count': grouped['count'].astype(np.int64)})
+
+
+#replaces the aggregates of the items in ids with the ones of their current reviews
+#an item whose reviews were all deleted drops out
+def merge_reviews(aggregates, ids, review_df, key):
+    kept = aggregates[~aggregates.index.isin([int(i) for i in ids])]
+    return pd.concat([kept, aggregate_reviews(review_df, key)]).sort_index()
+
+
+#mean rating, count and bayesian smoothed score per item:
+#(PRIOR_REVIEWS * overall mean + sum of ratings) / (PRIOR_REVIEWS + count)
+#so one five star review doesn't outrank fifty reviews averaging 4.8
+def review_scores(aggregates):
+    prior = aggregates['total'].sum() / aggregates['count'].sum() if len(aggregates) else (MIN_RATING + MAX_RATING) / 2
+    scores = aggregates.assign(
+        mean=aggregates['total'] / aggregates['count'],
+        score=(PRIOR_REVIEWS * prior + aggregates['total']) / (PRIOR_REVIEWS + aggregates['count']),
+    )
+    return scores, prior
+
+
+def save_reviews(name, aggregates):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = reviews_path(name)
+    replace_file(path, lambda f: np.savez(f, ids=aggregates.index.to_numpy(dtype=np.int64), total=aggregates['total'].to_numpy(), count=aggregates['count'].to_numpy()))
+
+
+#the stored aggregates, None until the offline job has run
+def load_reviews(name):
+    path = reviews_path(name)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as arrays:
+        return pd.DataFrame({'total': arrays['total'], 'count': arrays['count']}, index=arrays['ids'])
+
+
+#smoothed score of every catalog row scaled to 0..1, items without reviews get the overall mean
+#this is all the request path reads, one array lookup per candidate
+def catalog_quality(aggregates, catalog_ids):
+    scores, prior = review_scores(aggregates)
+    score = scores['score'].reindex(catalog_ids).fillna(prior).to_numpy(dtype=float)
+    return (score - MIN_RATING) / (MAX_RATING - MIN_RATING)
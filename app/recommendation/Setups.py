@@ -0,0 +1,80 @@
+import time
+import numpy as np
+from Metrics import METRICS
+
+#rackets and strings whose pairs are scored unless the request asks for more, and the most it may ask for
+SETUP_RACKETS = 5
+SETUP_STRINGS = 5
+MAX_SETUP_CANDIDATES = 20
+
+#how much the pairing counts against how well each half matches the answers
+COMPATIBILITY_WEIGHT = 1.0
+
+#rackets are strung a couple of lbs under their max tension
+STRINGING_MARGIN = 2
+#tension a 0.66mm string holds without breaking early, and how much more each extra mm of gauge holds
+GAUGE_TENSION = 28.5
+TENSION_PER_MM = 50
+#lbs over a string's limit that cut the tension fit to 1/e
+TENSION_TOLERANCE = 2
+#racket max tension at or under which a frame leans fully on the string for power, and the span over which that fades
+LOW_TENSION = 24
+TENSION_SPAN = 6
+#repulsion scale of the string catalog
+MIN_REPULSION = 6
+MAX_REPULSION = 9
+
+
+#compatibility of every racket with every string, (rackets x strings) in 0..1 by broadcasting
+#a thin string strung at a high tension racket's tension breaks early,
+#and a low tension frame wants a repulsive string to get its power back
+def compatibility(max_tension, gauge, repulsion):
+    tension = max_tension[:, None] - STRINGING_MARGIN
+    limit = GAUGE_TENSION + (gauge[None, :] - 0.66) * TENSION_PER_MM
+    tension_fit = np.exp(-np.maximum(tension - limit, 0) / TENSION_TOLERANCE)
+
+    power_need = np.clip((LOW_TENSION + TENSION_SPAN - max_tension[:, None]) / TENSION_SPAN, 0, 1)
+    power = np.clip((repulsion[None, :] - MIN_REPULSION) / (MAX_REPULSION - MIN_REPULSION), 0, 1)
+    power_fit = 1 - 0.5 * np.abs(power - power_need)
+
+    return tension_fit * power_fit
+
+
+#how well each neighbour matches the answers, 1 at distance 0 falling off with distance
+def relevance(engine, user_ans, model, indices):
+    query = engine.user_matrix([user_ans], model)[0]
+    return 1 / (1 + np.linalg.norm(model.scaled_x[indices] - query, axis=1))
+
+
+#best racket + string setups for one set of answers: the top n rackets and top m strings
+#from their own engines, every pair scored at once, the k best pairs returned as json
+#filters and ranges narrow the rackets like they do on /api/recommend
+def recommend_setups(user_ans, rackets, strings, n=SETUP_RACKETS, m=SETUP_STRINGS, k=3, filters=None, ranges=None):
+    racket_model = rackets.slot.get()
+    string_model = strings.slot.get()
+    racket_rows = rackets.ranked_neighbors([user_ans], racket_model, filters, ranges, n)[0]
+    string_rows = strings.ranked_neighbors([user_ans], string_model, k=m)[0]
+
+    start = time.perf_counter()
+    racket_fit = relevance(rackets, user_ans, racket_model, racket_rows)
+    string_fit = relevance(strings, user_ans, string_model, string_rows)
+    compat = compatibility(
+        racket_model.catalog['max_tension'].to_numpy(dtype=float)[racket_rows],
+        string_model.catalog['gauge'].to_numpy(dtype=float)[string_rows],
+        string_model.catalog['repulsion'].to_numpy(dtype=float)[string_rows],
+    )
+    score = (racket_fit[:, None] + string_fit[None, :] + COMPATIBILITY_WEIGHT * compat) / (2 + COMPATIBILITY_WEIGHT)
+
+    best = np.argsort(-score, axis=None, kind='stable')[:k]
+    pairs = np.unravel_index(best, score.shape)
+    METRICS.lap('setup', 'score', start)
+
+    setups = []
+    for r, s in zip(*pairs):
+        setups.append(
+            '{"compatibility":' + f'{compat[r, s]:.4f}' +
+            ',"racket":' + racket_model.records.json([racket_rows[r]])[1:-1] +
+            ',"score":' + f'{score[r, s]:.4f}' +
+            ',"string":' + string_model.records.json([string_rows[s]])[1:-1] + '}'
+        )
+    return '[' + ','.join(setups) + ']', f'{racket_model.version}+{string_model.version}'
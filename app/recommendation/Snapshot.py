@@ -0,0 +1,178 @@
+import os
+import json
+import hashlib
+import shutil
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+
+#bump whenever the layout of the artifact changes so old snapshots get rebuilt
+SNAPSHOT_FORMAT = 4
+
+#where the catalog snapshots live: a <name>.json per catalog pointing at the
+#<name>-<version> directory that holds that version's arrays
+SNAPSHOT_DIR = os.environ.get(
+    'RECOMMENDATION_SNAPSHOT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots')
+)
+
+
+def snapshot_path(name):
+    return os.path.join(SNAPSHOT_DIR, name + '.json')
+
+
+#write(f) fills a temp file of its own in path's directory, which is then renamed over path
+#so concurrent writers never share a temp file and a reader only ever opens a complete one
+def replace_file(path, write, mode='wb'):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+#the arrays of one catalog version as plain .npy files, mapped read-only when loaded
+#every flask worker serving that version shares one physical copy through the page cache
+#instead of holding its own, so extra workers cost almost no extra memory
+class Artifact:
+    def __init__(self, name, version):
+        self.path = os.path.join(SNAPSHOT_DIR, f"{name}-{version}")
+
+    def file(self, key):
+        return os.path.join(self.path, key + '.npy')
+
+    def exists(self, key):
+        return os.path.exists(self.file(key))
+
+    #written to a temp file and renamed so a worker never maps half an array
+    def save(self, key, array):
+        os.makedirs(self.path, exist_ok=True)
+        replace_file(self.file(key), lambda f: np.save(f, np.ascontiguousarray(array)))
+
+    def load(self, key):
+        return np.load(self.file(key), mmap_mode='r')
+
+    #the shared copy of an array, the first worker to need it builds and writes it
+    def shared(self, key, build):
+        if not self.exists(key):
+            self.save(key, build())
+        return self.load(key)
+
+
+#an array kept in the artifact when there is one, built in process memory otherwise
+def shared_array(artifact, key, build):
+    return build() if artifact is None else artifact.shared(key, build)
+
+
+#content hash of the catalog, changes whenever a row, a feature, a feature weight or the fitted scaler changes
+#the scaler is part of it because an incrementally updated catalog keeps its old scaler: a refit of
+#the same rows scales them differently and must not land in that version's directory and reuse its arrays
+def catalog_version(catalog_df, x, weights, scale):
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(x, dtype=float).tobytes())
+    h.update(np.ascontiguousarray(weights, dtype=float).tobytes())
+    h.update(np.ascontiguousarray(scale.mean_, dtype=float).tobytes())
+    h.update(np.ascontiguousarray(scale.scale_, dtype=float).tobytes())
+    h.update(catalog_df.to_json(orient='split', index=False).encode('utf-8'))
+    return h.hexdigest()[:12]
+
+
+#writes the standardized catalog, fitted scaler and feature matrices to disk
+#weights are the feature weights folded into scale and scaled_x, None when there are none
+def save_snapshot(name, catalog_df, cols, scale, x, scaled_x, weights=None):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    meta_path = snapshot_path(name)
+
+    x = np.asarray(x, dtype=float)
+    weights = np.ones(len(cols)) if weights is None else np.asarray(weights, dtype=float)
+    version = catalog_version(catalog_df, x, weights, scale)
+
+    artifact = Artifact(name, version)
+    artifact.save('x', x)
+    artifact.save('scaled_x', np.asarray(scaled_x, dtype=float))
+
+    meta = {
+        'format': SNAPSHOT_FORMAT,
+        'version': version,
+        'built_at': time.time(),
+        'cols': list(cols),
+        'weights': weights.tolist(),
+        'scaler': {
+            'mean': scale.mean_.tolist(),
+            'var': scale.var_.tolist(),
+            'scale': scale.scale_.tolist(),
+            'n_samples_seen': int(scale.n_samples_seen_),
+        },
+        'catalog': json.loads(catalog_df.to_json(orient='split', index=False)),
+    }
+
+    #the arrays are in place before the pointer moves, so a booting worker never reads half a snapshot
+    previous = read_meta(name)
+    replace_file(meta_path, lambda f: json.dump(meta, f, separators=(',', ':')), 'w')
+
+    #keep the version just replaced for workers still serving it, drop anything older
+    keep = {artifact.path}
+    if previous is not None:
+        keep.add(Artifact(name, previous['version']).path)
+    for entry in os.listdir(SNAPSHOT_DIR):
+        path = os.path.join(SNAPSHOT_DIR, entry)
+        if entry.startswith(name + '-') and os.path.isdir(path) and path not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+    return version
+
+
+#the pointer of a catalog, None when it is missing or can't be read
+def read_meta(name):
+    meta_path = snapshot_path(name)
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Could not read the {name} snapshot pointer, treating it as missing: {e}")
+        return None
+    return meta if isinstance(meta, dict) else None
+
+
+#loads a snapshot written by save_snapshot, None when missing or out of date
+#x and scaled_x come back as read-only memory maps
+def load_snapshot(name):
+    meta = read_meta(name)
+    if meta is None or meta.get('format') != SNAPSHOT_FORMAT:
+        return None
+
+    artifact = Artifact(name, meta['version'])
+    if not (artifact.exists('x') and artifact.exists('scaled_x')):
+        return None
+
+    scaler = meta['scaler']
+    scale = StandardScaler()
+    scale.mean_ = np.array(scaler['mean'])
+    scale.var_ = np.array(scaler['var'])
+    scale.scale_ = np.array(scaler['scale'])
+    scale.n_features_in_ = len(meta['cols'])
+    scale.n_samples_seen_ = scaler['n_samples_seen']
+
+    catalog = meta['catalog']
+    catalog_df = pd.DataFrame(catalog['data'], columns=catalog['columns'])
+
+    return {
+        'version': meta['version'],
+        'built_at': meta['built_at'],
+        'catalog': catalog_df,
+        'cols': meta['cols'],
+        'weights': np.array(meta['weights']),
+        'scale': scale,
+        'x': artifact.load('x'),
+        'scaled_x': artifact.load('scaled_x'),
+        'artifact': artifact,
+    }
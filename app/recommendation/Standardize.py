@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+
+
+#runs a vectorized transform over the distinct values of col only and spreads the result back
+#catalog spec columns repeat the same few strings, so this is far less work than a per-row apply
+#missing values (None / NaN) skip the transform and come back as missing
+def map_unique(col, transform, missing=None):
+    codes, uniques = pd.factorize(col)
+    values = np.asarray(transform(pd.Series(uniques, dtype=object)))
+    #code -1 marks a missing value, which lands on the appended slot
+    values = np.append(values, [missing])
+    return pd.Series(values[codes], index=col.index)
+
+
+#True where x contains any of the words, plain substring matching like `any(i in x for i in words)`
+def contains_any(x, words):
+    found = np.zeros(len(x), dtype=bool)
+    for word in words:
+        found |= x.str.contains(word, regex=False).to_numpy(dtype=bool)
+    return found
@@ -1,19 +1,35 @@
-from supabase import create_client
-import supabase_env
-import json
 import numpy as np
-import pandas as pd
-from sklearn.neighbors import NearestNeighbors
-from sklearn.preprocessing import StandardScaler
-import re
+from Standardize import map_unique, contains_any
+from Engine import Recommender
 
-supabase = create_client(supabase_env.NEXT_PUBLIC_SUPABASE_URL, supabase_env.NEXT_PUBLIC_SUPABASE_ANON_KEY )
+#fields of each recommended item in the response
+RESPONSE_COLUMNS = ['string_id', 'name', 'gauge', 'img_url']
 
+#numeric columns that take hard min / max ranges, kept sorted per partition
+RANGE_COLUMNS = ['gauge']
 
+#columns with their own sub-indexes so hard filters on them cost the same as no filter
+PARTITIONS = ['manufacturer_id']
 
+SNAPSHOT_NAME = 'string'
 
+#features whose share of each neighbour's distance is returned when a request asks for explanations
+EXPLAIN_FEATURES = ['gauge', 'control', 'repulsion', 'durability']
 
 
+
+
+
+
+#feature importance in the distance
+#folded into the stored scaled matrix at build time, changing one rescales the snapshot at the next load
+feature_weights = {
+    "gauge": 1,
+    "control": 1,
+    "repulsion": 1,
+    "durability": 1,
+}
+
 #question importance
 question_weights = {
     "experience": 2.5,
@@ -238,78 +254,46 @@ translation_map = {
 
 }
 
-#get data from supabase
-string_supabase = supabase.table('string').select('*').execute()
-strings = string_supabase.data
-string_df = pd.DataFrame(strings)
-string_df = string_df.drop_duplicates(subset='string_id')
-string_df = string_df.drop_duplicates(subset='name', keep='first')
-
-
-#standardizer
-
 def standardizer(df):
     df['gauge'] = df['gauge'].astype(str).str.replace('mm','').astype(float)
 
-    def std(col):
-
-        if pd.isna(col):
-            return {'control':6, 'durability':7 , 'repulsion':7 }
+    #each std_ function works on the distinct feel descriptions, map_unique spreads them over the rows
+    #strings with no feel at all get control 6, durability 7, repulsion 7
 
-        x = str(col).lower().strip()
+    #repulsion
+    def std_repulsion(col):
+        x = col.astype(str).str.lower().str.strip()
 
-        #repulsion
         hrepulsion = ['high resilience', 'high repulsion']
         mrepulsion = ['medium repulsion']
 
-        if any(i in x for i in hrepulsion):
-            repulsion = 9
+        return np.select([contains_any(x, hrepulsion), contains_any(x, mrepulsion)], [9, 6], default=7)
 
-        elif any(i in x for i in mrepulsion):
-            repulsion = 6
-            
-        else:
-            repulsion = 7
+    #durability
+    def std_durability(col):
+        x = col.astype(str).str.lower().str.strip()
 
-
-        #durability
         hdurability = ['high durability', 'great durability']
 
-        if any(i in x for i in hdurability):
-            durability = 8
+        return np.where(contains_any(x, hdurability), 8, 6)
+
+    #control
+    def std_control(col):
+        x = col.astype(str).str.lower().str.strip()
 
-        else:
-            durability = 6
-            
-        #control
         hcontrol = ['excellent control']
         mcontrol = ['hard feeling']
         scontrol = ['soft feeling']
 
-        if any(i in x for i in hcontrol):
-            control = 8
-
-
-        elif any(i in x for i in mcontrol):
-            control = 7
-
-        elif any(i in x for i in scontrol):
-            control = 5
-
-
-        else:
-            control = 6
-
-        return {'control':control, 'durability':durability, 'repulsion':repulsion}
-
+        return np.select(
+            [contains_any(x, hcontrol), contains_any(x, mcontrol), contains_any(x, scontrol)],
+            [8, 7, 5],
+            default=6
+        )
 
-    
-
-    updf = df['feel'].apply(std)
-
-    df['control'] = updf.apply(lambda x: x['control'])
-    df['repulsion'] = updf.apply(lambda x: x['repulsion'])
-    df['durability'] = updf.apply(lambda x: x['durability'])
+    df['control'] = map_unique(df['feel'], std_control, 6)
+    df['repulsion'] = map_unique(df['feel'], std_repulsion, 7)
+    df['durability'] = map_unique(df['feel'], std_durability, 7)
 
     df['gauge'] = df['gauge'].fillna(0.67)
     df['control'] = df['control'].fillna(6)
@@ -322,59 +306,43 @@ def standardizer(df):
     return df
 
 
-string_df = standardizer(string_df)
-
-
 #prepare information for training
 excludes = ['string_id', 'name', 'manufacturer_id', 'img_url', 'feel']
 
 col_categories = []
-col_onehot = pd.get_dummies(string_df, columns=col_categories)
-
-cols = [ i for i in col_onehot if i not in excludes]
 
-scale = StandardScaler()
-
-x = col_onehot[cols].values
-
-scaled_x = scale.fit_transform(x)
-
-#knn model
-knn = NearestNeighbors(n_neighbors=3, metric='euclidean')
-knn.fit(scaled_x)
+#the string catalog on the shared engine, the names below are what the service and scripts call
+engine = Recommender(
+    name=SNAPSHOT_NAME,
+    key='string_id',
+    standardize=standardizer,
+    categories=col_categories,
+    excludes=excludes,
+    baseline=baseline,
+    translation_map=translation_map,
+    question_weights=question_weights,
+    feature_weights=feature_weights,
+    response_columns=RESPONSE_COLUMNS,
+    range_columns=RANGE_COLUMNS,
+    partitions=PARTITIONS,
+    explain_features=EXPLAIN_FEATURES,
+)
+
+model_slot = engine.slot
+fetch_strings = engine.fetch
+build_catalog = engine.build_catalog
+refresh_snapshot = engine.refresh_snapshot
+assemble_model = engine.assemble_model
+build_model = engine.build_model
+update_strings = engine.update
+load_model = engine.load_model
+reload_model = engine.reload_model
+get_string_rec = engine.recommend
+get_string_rec_json = engine.recommend_json
+get_string_rec_batch = engine.recommend_batch
+get_string_rec_batch_json = engine.recommend_batch_json
 
 
 #creates user vector from user answers
-def user_vector(user_ans):
-
-    vec = np.array([baseline.get(col, 0) for col in cols], dtype=float)
-    col_index = {k: i for i, k in enumerate(cols)}
-
-    for question, answer in user_ans.items():
-        if question not in translation_map:
-            continue
-
-        if answer not in translation_map[question]:
-            continue
-
-        metrics = translation_map[question][answer].get("metrics", {})
-        weight = question_weights.get(question, 1)
-
-        for key_metric, value_metric in metrics.items():
-            if key_metric in col_index:
-                index = col_index[key_metric]
-                vec[index] += weight * value_metric
-
-    vec = vec.reshape(1, -1)
-    scaled = scale.transform(vec)
-    return scaled
-
-#generates recommendation
-def get_string_rec(user_ans):
-    scaled_user = user_vector(user_ans)
-    distances, indices = knn.kneighbors(scaled_user)
-    rec = string_df.iloc[indices[0]][['string_id', 'name', 'gauge', 'img_url']].to_dict(orient='records')
-    return rec
-
-
-
+def user_vector(user_ans, model):
+    return engine.user_matrix([user_ans], model)
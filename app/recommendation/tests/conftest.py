@@ -0,0 +1,5 @@
+import os
+import sys
+
+#the recommender modules import each other by their flat names, like Recommendation_Engine.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
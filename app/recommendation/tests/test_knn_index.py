@@ -0,0 +1,32 @@
+import numpy as np
+from KnnIndex import BruteForceIndex, IVFIndex
+
+
+#a catalog where a third of the rows are identical, like rackets whose missing specs all got the defaults
+def tied_catalog():
+    rng = np.random.default_rng(0)
+    x = rng.integers(0, 3, (400, 4)).astype(float)
+    x[:150] = 0
+    return x, rng.integers(0, 3, (30, 4)).astype(float)
+
+
+def test_pages_follow_distance_then_row_order():
+    x, queries = tied_catalog()
+    d2 = ((x[None] - queries[:, None]) ** 2).sum(axis=2)
+    expected = np.lexsort((np.broadcast_to(np.arange(len(x)), d2.shape), d2), axis=1)
+
+    index = BruteForceIndex(x)
+    for k in [1, 3, 7, 10, 25]:
+        for offset in range(0, len(x), k):
+            distances, indices = index.kneighbors(queries, k, offset)
+            assert (indices == expected[:, offset:offset + k]).all()
+
+
+def test_paging_never_repeats_a_row():
+    x, queries = tied_catalog()
+    for index in [BruteForceIndex(x), IVFIndex(x, n_cells=1)]:
+        for k in [3, 10]:
+            pages = [index.kneighbors(queries, k, offset)[1] for offset in range(0, len(x), k)]
+            seen = np.concatenate(pages, axis=1)
+            for row in seen:
+                assert len(np.unique(row)) == len(x)
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+import Snapshot
+from Snapshot import catalog_version, load_snapshot, save_snapshot
+
+
+def catalog():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(50, 3))
+    return pd.DataFrame({'racket_id': np.arange(50)}), ['a', 'b', 'c'], x
+
+
+def test_version_includes_the_scaler():
+    df, cols, x = catalog()
+    fitted = StandardScaler().fit(x)
+    #an incremental update keeps the scaler fitted on an older catalog
+    kept = StandardScaler().fit(x[:40])
+    assert catalog_version(df, x, np.ones(3), fitted) != catalog_version(df, x, np.ones(3), kept)
+    assert catalog_version(df, x, np.ones(3), fitted) == catalog_version(df, x, np.ones(3), StandardScaler().fit(x))
+
+
+#a refit of rows that were folded in under the old scaler gets its own directory, not the arrays scaled by the old one
+def test_refit_does_not_reuse_the_updated_versions_arrays(tmp_path, monkeypatch):
+    monkeypatch.setattr(Snapshot, 'SNAPSHOT_DIR', str(tmp_path))
+    df, cols, x = catalog()
+
+    kept = StandardScaler().fit(x[:40])
+    updated = save_snapshot('racket', df, cols, kept, x, kept.transform(x))
+    refit = StandardScaler().fit(x)
+    version = save_snapshot('racket', df, cols, refit, x, refit.transform(x))
+
+    assert version != updated
+    snap = load_snapshot('racket')
+    assert snap['version'] == version
+    assert np.allclose(snap['scaled_x'], refit.transform(x))
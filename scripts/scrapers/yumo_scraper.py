@@ -233,6 +233,9 @@ class YumoScraper:
         self.retailer_id = None
         if self.supabase:
             self._load_retailer()
+        
+        # Racket IDs added or changed this run, handed to the recommender at the end
+        self.changed_racket_ids = set()
 
     def _load_manufacturers(self):
         """Load manufacturers into memory for quick lookup"""
@@ -292,6 +295,7 @@ class YumoScraper:
                 }).execute()
                 print(f"       Linked to yumo: ${price_usd:.2f}")
             
+            self.changed_racket_ids.add(racket_id)
             return True
         except Exception as e:
             print(f"       Error linking to retailer: {e}")
@@ -870,6 +874,7 @@ class YumoScraper:
         try:
             print(f"  Updating racket ID {racket_id} with specs: {list(updates.keys())}")
             response = self.supabase.table('racket').update(updates).eq('racket_id', racket_id).execute()
+            self.changed_racket_ids.add(racket_id)
             return True
         except Exception as e:
             print(f"  Error updating racket {racket_id}: {e}")
@@ -917,6 +922,7 @@ class YumoScraper:
             
             # Get the newly created racket_id
             new_racket_id = response.data[0]['racket_id']
+            self.changed_racket_ids.add(new_racket_id)
             
             # Link to retailer with price and URL
             if price and new_racket_data.get('url'):
@@ -928,6 +934,29 @@ class YumoScraper:
             return False
 
     
+    def notify_recommender(self) -> bool:
+        """
+        Send the racket IDs changed this run to the recommendation service so it
+        can fold them into the live model instead of rebuilding it.
+        Only runs when RECOMMENDER_URL is set (e.g. http://localhost:3001).
+        """
+        recommender_url = os.getenv('RECOMMENDER_URL')
+        if not recommender_url or not self.changed_racket_ids:
+            return False
+        
+        try:
+            response = self.session.post(
+                f"{recommender_url.rstrip('/')}/api/catalog/rackets",
+                json={'racket_ids': sorted(self.changed_racket_ids)},
+                timeout=300,
+            )
+            response.raise_for_status()
+            print(f"Recommender updated {len(self.changed_racket_ids)} rackets (model {response.json().get('version')})")
+            return True
+        except Exception as e:
+            print(f"Could not update recommender: {e}")
+            return False
+
     def normalize_specifications(self, data: List[Dict]) -> List[Dict]:
         """
         Normalize all specifications to consistent field names.
@@ -1271,6 +1300,9 @@ def main():
                 stats['new_added'] -= 1
                 stats['skipped'] += 1
     
+    # Fold the changed rackets into the running recommender
+    scraper.notify_recommender()
+    
     # Save summary
     gathering_dir = 'scripts/gathering'
     if not os.path.isdir(gathering_dir):